@@ -0,0 +1,337 @@
+"""
+离线性能测试：用本地模拟的趣绮梦云黑API测试批量检查、大扫除和进群检测的吞吐
+
+模拟API支持可配置的延迟、错误率、格式错误的JSON（如 [,{} ] ）以及 20次/5秒 的频率限制。
+真实的频率限制下扫描3000人需要十几分钟，因此所有时间（频率窗口、延迟、合并窗口）
+都会乘以 --time-scale 缩放，报告中同时给出换算回真实时间的预估耗时。
+
+需要在安装了AstrBot的环境中运行：
+    python bench/bench_scan.py
+    python bench/bench_scan.py --sizes 500 2000 --scenarios scan --time-scale 0.05
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from collections import deque
+
+import httpx
+
+PLUGIN_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = "qimeng_bench_plugin"
+
+
+def load_plugin_module():
+    """
+    插件目录名包含连字符，不能直接import，这里以包的形式手动加载
+    """
+    if PACKAGE_NAME not in sys.modules:
+        package = types.ModuleType(PACKAGE_NAME)
+        package.__path__ = [PLUGIN_ROOT]
+        sys.modules[PACKAGE_NAME] = package
+    return importlib.import_module(f"{PACKAGE_NAME}.main")
+
+
+class MockQimengAPI:
+    """
+    模拟 all_f.php 接口
+    """
+
+    def __init__(self, latency=0.15, jitter=0.1, error_rate=0.0, malformed_rate=0.0,
+                 blacklist_ratio=0.01, max_requests=20, time_window=5.0, time_scale=1.0):
+        self.latency = latency * time_scale
+        self.jitter = jitter * time_scale
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.blacklist_ratio = blacklist_ratio
+        self.max_requests = max_requests
+        self.time_window = time_window * time_scale
+        self._window = deque()
+        self.requests = 0
+        self.violations = 0
+        self.errors = 0
+        self.malformed = 0
+
+    def is_blacklisted(self, user_id):
+        # 结果只由用户ID决定，保证多次运行之间可比
+        return (int(user_id) * 2654435761) % 10000 < self.blacklist_ratio * 10000
+
+    def _body(self, user_id):
+        blacklisted = self.is_blacklisted(user_id)
+        record = {
+            "yh": "true" if blacklisted else "false",
+            "note": "模拟云黑记录" if blacklisted else "",
+            "type": "bilei" if blacklisted else "",
+            "admin": "",
+            "level": "3" if blacklisted else "",
+            "date": "2024-01-01" if blacklisted else "",
+        }
+        body = json.dumps({"info": [{"uuid": user_id}, {"status": "ok"}, record]}, ensure_ascii=False)
+        if self.malformed_rate and random.random() < self.malformed_rate:
+            # 模拟API偶尔返回的 [,{} ] 格式错误
+            self.malformed += 1
+            body = body.replace('{"info": [', '{"info": [,', 1)
+        return body
+
+    async def handler(self, request):
+        now = time.monotonic()
+        self.requests += 1
+        while self._window and self._window[0] <= now - self.time_window:
+            self._window.popleft()
+        if len(self._window) >= self.max_requests:
+            self.violations += 1
+            return httpx.Response(429, text="请求过于频繁")
+        self._window.append(now)
+
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            return httpx.Response(500, text="Internal Server Error")
+        return httpx.Response(200, text=self._body(request.url.params.get("id", "0")))
+
+
+class MockBot:
+    """
+    模拟OneBot客户端
+    """
+
+    def __init__(self, groups):
+        self.groups = groups
+        self.kicked = 0
+        self.messages = 0
+
+    async def get_group_member_list(self, group_id):
+        return [{"user_id": int(user_id)} for user_id in self.groups[int(group_id)]]
+
+    async def set_group_kick(self, group_id, user_id, reject_add_request=False):
+        self.kicked += 1
+
+    async def send_group_msg(self, group_id, message):
+        self.messages += 1
+
+
+class MockEvent:
+    """
+    模拟AstrMessageEvent，只实现插件用到的接口
+    """
+
+    def __init__(self, bot, group_id, raw_message=None):
+        self.bot = bot
+        self._group_id = str(group_id)
+        self.message_obj = types.SimpleNamespace(raw_message=raw_message or {}, group_id=str(group_id))
+
+    def get_group_id(self):
+        return self._group_id
+
+    def get_sender_id(self):
+        return "10000"
+
+    def plain_result(self, text):
+        return ("plain", text)
+
+    def image_result(self, path):
+        return ("image", path)
+
+    def chain_result(self, chain):
+        return ("chain", chain)
+
+
+def make_members(count, offset=0):
+    return [str(1000000 + offset + i) for i in range(count)]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[index]
+
+
+async def make_plugin(module, api, args, groups, data_dir):
+    # 插件的持久化数据（成员快照等）写入每个用例独立的临时目录，不污染真实的插件数据目录，
+    # 本地云黑库和待踢出列表会让后续用例跳过请求，测试时关闭
+    module._get_data_dir = lambda: data_dir
+    config = {
+        "api_key": "bench",
+        "cache_enabled": False,
+        "mirror_enabled": False,
+        "pending_kick_persist": False,
+        "enabled_groups": list(groups),
+        "auto_check_whitelist": list(groups),
+        "scan_progress_interval": 0,
+        "kick_progress_interval": 0,
+        "join_batch_window": 0.3 * args.time_scale,
+    }
+    plugin = module.QimengYunheiPlugin(types.SimpleNamespace(), config)
+    # 频率窗口和安全余量按相同比例缩放，与插件的实际配置保持一致；
+    # 事件循环的调度抖动不会随之缩小，缩放比例过小时可能出现超限，如实报告
+    plugin.rate_scheduler.time_window = plugin.time_window * args.time_scale
+    plugin.rate_scheduler.safety_margin = plugin.rate_scheduler.safety_margin * args.time_scale
+    # 把真实的API替换为本地模拟接口，重试退避时间同样缩放
+    transport_module = importlib.import_module(f"{PACKAGE_NAME}.transport")
+    await plugin.http_client.aclose()
+    plugin.http_client = transport_module.ResilientHttpClient(
+        transport=httpx.MockTransport(api.handler),
+        backoff_base=0.5 * args.time_scale,
+        backoff_max=5 * args.time_scale,
+        recovery_timeout=30 * args.time_scale,
+        metrics=plugin.metrics,
+    )
+
+    # 记录每个请求从排队到返回的耗时
+    latencies = []
+    original_request = plugin._rate_limited_request
+
+    async def timed_request(*request_args, **request_kwargs):
+        start = time.perf_counter()
+        try:
+            return await original_request(*request_args, **request_kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    plugin._rate_limited_request = timed_request
+    return plugin, latencies
+
+
+async def run_batch_check(plugin, bot, members):
+    await plugin._batch_check_users(members, "bench")
+    return len(members)
+
+
+async def run_scan(plugin, bot, members):
+    async for _ in plugin.scan_group_members(MockEvent(bot, 1)):
+        pass
+    return len(members)
+
+
+async def run_join_burst(plugin, bot, members):
+    # 同一批账号同时加入两个群，模拟炸群
+    events = []
+    for user_id in members:
+        for group_id in (1, 2):
+            raw = {"post_type": "notice", "notice_type": "group_increase", "group_id": group_id, "user_id": int(user_id)}
+            events.append(MockEvent(bot, group_id, raw))
+
+    async def handle(event):
+        async for _ in plugin.handle_group_add(event):
+            pass
+
+    await asyncio.gather(*[handle(event) for event in events])
+    return len(events)
+
+
+SCENARIOS = {
+    "batch_check": run_batch_check,
+    "scan": run_scan,
+    "join_burst": run_join_burst,
+}
+
+
+async def run_case(module, scenario, size, args):
+    api = MockQimengAPI(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        malformed_rate=args.malformed_rate, time_scale=args.time_scale,
+    )
+    members = make_members(size)
+    groups = {1: members, 2: members}
+    bot = MockBot(groups)
+    with tempfile.TemporaryDirectory(prefix="qimeng_bench_") as data_dir:
+        plugin, latencies = await make_plugin(module, api, args, groups, data_dir)
+        margin = plugin.rate_scheduler.safety_margin
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            items = await SCENARIOS[scenario](plugin, bot, members)
+        finally:
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            await plugin.terminate()
+
+    return {
+        "scenario": scenario,
+        "size": size,
+        "items": items,
+        "requests": api.requests,
+        "elapsed": elapsed,
+        "projected": elapsed / args.time_scale,
+        "throughput": api.requests / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50) / args.time_scale,
+        "p99": percentile(latencies, 99) / args.time_scale,
+        "peak_mb": peak / 1024 / 1024,
+        "violations": api.violations,
+        "errors": api.errors,
+        "malformed": api.malformed,
+        "margin": margin / args.time_scale,
+        "scaled_margin": margin,
+    }
+
+
+def format_report(results, args):
+    lines = [
+        f"time_scale={args.time_scale} latency={args.latency}s error_rate={args.error_rate} malformed_rate={args.malformed_rate}",
+    ]
+    if results:
+        # 安全余量随时间一起缩放，缩放后的余量过小时事件循环抖动可能导致超限
+        lines.append(
+            f"rate_limit_margin={results[0]['margin']:.2f}s (scaled {results[0]['scaled_margin'] * 1000:.1f}ms)"
+        )
+    lines += [
+        "",
+        f"{'scenario':<12} {'size':>6} {'requests':>9} {'elapsed(s)':>11} {'real(s)':>9} {'req/s(real)':>12} "
+        f"{'p50(s)':>8} {'p99(s)':>8} {'peak(MB)':>9} {'violations':>11} {'errors':>7} {'malformed':>10}",
+    ]
+    for r in results:
+        lines.append(
+            f"{r['scenario']:<12} {r['size']:>6} {r['requests']:>9} {r['elapsed']:>11.2f} {r['projected']:>9.1f} "
+            f"{r['throughput'] * args.time_scale:>12.2f} {r['p50']:>8.2f} {r['p99']:>8.2f} {r['peak_mb']:>9.2f} "
+            f"{r['violations']:>11} {r['errors']:>7} {r['malformed']:>10}"
+        )
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="趣绮梦云黑插件离线性能测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 2000, 3000], help="群成员数")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS), help="测试场景")
+    parser.add_argument("--time-scale", type=float, default=0.02, help="时间缩放比例，1为真实时间")
+    parser.add_argument("--latency", type=float, default=0.15, help="模拟API平均延迟（秒，真实时间）")
+    parser.add_argument("--jitter", type=float, default=0.1, help="模拟API延迟标准差（秒，真实时间）")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="返回HTTP 500的比例")
+    parser.add_argument("--malformed-rate", type=float, default=0.02, help="返回格式错误JSON的比例")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+    parser.add_argument("--json", action="store_true", help="以JSON格式输出结果")
+    parser.add_argument("--verbose", action="store_true", help="输出插件日志")
+    return parser.parse_args(argv)
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    module = load_plugin_module()
+    if not args.verbose:
+        module.logger.setLevel(logging.WARNING)
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+    results = []
+    for scenario in args.scenarios:
+        for size in args.sizes:
+            results.append(await run_case(module, scenario, size, args))
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print(format_report(results, args))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
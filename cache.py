@@ -0,0 +1,166 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from astrbot.api import logger
+
+
+class VerdictCache:
+    """
+    云黑查询结果的本地持久化缓存
+    以用户ID为键保存API返回的 info[2] 记录，云黑与正常用户使用不同的有效期，
+    超过容量上限时按检查时间淘汰最旧的记录。
+    数据库可能与其他进程共享，读写会等待数据库锁，应在线程池中调用
+    """
+
+    # 每写入多少条记录检查一次容量
+    EVICT_CHECK_INTERVAL = 100
+
+    def __init__(self, db_path, blacklist_ttl=86400, clean_ttl=21600, max_entries=50000, timeout=1.0):
+        self.db_path = db_path
+        self.blacklist_ttl = blacklist_ttl
+        self.clean_ttl = clean_ttl
+        self.max_entries = max_entries
+        self._writes_since_evict = 0
+        # 连接在线程池的多个线程间共用，同一时间只允许一个线程操作；
+        # 读写使用不同的连接，WAL模式下读取不会被等待锁的写入挡住
+        self._lock = threading.RLock()
+        self._read_lock = threading.Lock()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        # 数据库被其他进程锁住时最多等待timeout秒，超时的读写直接失败，不长时间占用线程
+        self._conn = sqlite3.connect(db_path, timeout=timeout, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts ("
+            "user_id TEXT PRIMARY KEY, "
+            "blacklisted INTEGER NOT NULL, "
+            "info TEXT NOT NULL, "
+            "checked_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_verdicts_checked_at ON verdicts (checked_at)")
+        self._conn.commit()
+        self._read_conn = sqlite3.connect(db_path, timeout=timeout, check_same_thread=False)
+        # 启动时清理一次过期记录
+        self.purge_expired()
+
+    def _is_fresh(self, blacklisted, checked_at, now):
+        ttl = self.blacklist_ttl if blacklisted else self.clean_ttl
+        return checked_at >= now - ttl
+
+    def get(self, user_id):
+        """
+        获取单个用户的缓存记录，未命中或已过期时返回None
+        """
+        with self._read_lock:
+            row = self._read_conn.execute(
+                "SELECT blacklisted, info, checked_at FROM verdicts WHERE user_id = ?",
+                (str(user_id),)
+            ).fetchone()
+        if not row:
+            return None
+        blacklisted, info, checked_at = row
+        if not self._is_fresh(blacklisted, checked_at, time.time()):
+            return None
+        return json.loads(info)
+
+    def get_many(self, user_ids, chunk_size=500):
+        """
+        批量获取缓存记录，返回 {user_id: info}，只包含命中且未过期的用户
+        """
+        now = time.time()
+        hits = {}
+        user_ids = [str(user_id) for user_id in user_ids]
+        for i in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[i:i + chunk_size]
+            placeholders = ",".join("?" * len(chunk))
+            with self._read_lock:
+                rows = self._read_conn.execute(
+                    f"SELECT user_id, blacklisted, info, checked_at FROM verdicts WHERE user_id IN ({placeholders})",
+                    chunk
+                ).fetchall()
+            for user_id, blacklisted, info, checked_at in rows:
+                if self._is_fresh(blacklisted, checked_at, now):
+                    hits[user_id] = json.loads(info)
+        return hits
+
+    def set(self, user_id, info, blacklisted):
+        """
+        写入单个用户的查询结果
+        """
+        self.set_many([(user_id, info, blacklisted)])
+
+    def set_many(self, entries):
+        """
+        在同一个事务中写入多个用户的查询结果，entries为 (user_id, info, blacklisted) 列表
+        """
+        now = time.time()
+        rows = [
+            (str(user_id), 1 if blacklisted else 0, json.dumps(info, ensure_ascii=False), now)
+            for user_id, info, blacklisted in entries
+        ]
+        if not rows:
+            return
+        with self._lock:
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO verdicts (user_id, blacklisted, info, checked_at) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._writes_since_evict += len(rows)
+            if self._writes_since_evict >= self.EVICT_CHECK_INTERVAL:
+                self._writes_since_evict = 0
+                self.evict()
+
+    def purge_expired(self):
+        """
+        删除所有已过期的记录
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM verdicts WHERE (blacklisted = 1 AND checked_at < ?) OR (blacklisted = 0 AND checked_at < ?)",
+                (now - self.blacklist_ttl, now - self.clean_ttl)
+            )
+            self._conn.commit()
+        if cursor.rowcount:
+            logger.debug(f"已清理 {cursor.rowcount} 条过期的云黑缓存记录")
+
+    def evict(self):
+        """
+        清理过期记录，并在超过容量上限时淘汰最旧的记录
+        """
+        with self._lock:
+            self.purge_expired()
+            count = self._conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM verdicts WHERE user_id IN "
+                    "(SELECT user_id FROM verdicts ORDER BY checked_at ASC LIMIT ?)",
+                    (overflow,)
+                )
+                self._conn.commit()
+        if overflow > 0:
+            logger.debug(f"云黑缓存超过容量上限，已淘汰 {overflow} 条最旧记录")
+
+    def __len__(self):
+        with self._read_lock:
+            return self._read_conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+
+    def close(self):
+        try:
+            with self._lock, self._read_lock:
+                self._read_conn.close()
+                self._conn.close()
+        except Exception:
+            pass
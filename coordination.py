@@ -0,0 +1,91 @@
+import os
+import sqlite3
+import time
+
+from astrbot.api import logger
+
+
+def is_lock_error(error):
+    """
+    是否为其他连接持有锁导致的数据库繁忙错误
+    """
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
+
+class SharedRateWindow:
+    """
+    多个进程共享的请求频率窗口
+    使用同一个API Key的多个机器人进程把发放的令牌记录在同一个SQLite文件中，
+    每次发放前在 BEGIN IMMEDIATE 事务内统计窗口内的令牌数，保证所有进程合计不超过max_requests。
+    只适用于同一台机器上的进程，时间使用系统时钟
+    """
+
+    # 其他进程持有写锁时，等待多久后重试（秒）
+    BUSY_RETRY_DELAY = 0.02
+
+    def __init__(self, db_path, max_requests=20, time_window=5, safety_margin=0.0, timeout=0.5):
+        self.db_path = db_path
+        self.max_requests = max_requests
+        self.time_window = time_window
+        self.safety_margin = safety_margin
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        # 自动提交模式，事务由 try_acquire 显式控制；
+        # 写锁被其他进程持有时只等待timeout秒，之后由调用方稍后重试
+        self._conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS rate_grants (granted_at REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_rate_grants_granted_at ON rate_grants (granted_at)")
+
+    def try_acquire(self):
+        """
+        尝试获取一个令牌，成功返回0，否则返回需要等待的秒数
+        其他进程持有写锁属于正常的争用，同样返回等待时间而不是发放令牌；
+        会阻塞等待数据库锁，应在线程池中调用
+        """
+        window = self.time_window + self.safety_margin
+        conn = self._conn
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            if is_lock_error(e):
+                return self.BUSY_RETRY_DELAY
+            raise
+        try:
+            now = time.time()
+            conn.execute("DELETE FROM rate_grants WHERE granted_at <= ?", (now - window,))
+            count, oldest = conn.execute("SELECT COUNT(*), MIN(granted_at) FROM rate_grants").fetchone()
+            if count >= self.max_requests:
+                conn.execute("COMMIT")
+                return max(0.001, oldest + window - now)
+            conn.execute("INSERT INTO rate_grants (granted_at) VALUES (?)", (now,))
+            conn.execute("COMMIT")
+            return 0.0
+        except BaseException as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            if is_lock_error(e):
+                return self.BUSY_RETRY_DELAY
+            raise
+
+    def in_window(self):
+        """
+        所有进程在最近time_window秒内使用的令牌数
+        """
+        try:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM rate_grants WHERE granted_at > ?", (time.time() - self.time_window,)
+            ).fetchone()[0]
+        except sqlite3.Error as e:
+            logger.debug(f"读取共享频率窗口失败: {str(e)}")
+            return None
+
+    def close(self):
+        try:
+            self._conn.close()
+        except Exception:
+            pass
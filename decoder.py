@@ -0,0 +1,139 @@
+import json
+import re
+
+from astrbot.api import logger
+
+# 有orjson时使用更快的JSON解析
+try:
+    import orjson
+
+    def _loads(data):
+        return orjson.loads(data)
+except ImportError:
+    orjson = None
+
+    def _loads(data):
+        return json.loads(data)
+
+# 修复以逗号开头的数组元素（如 [,{} ] 这种情况）
+_LEADING_COMMA = re.compile(rb'\[\s*,')
+# 修复以逗号结尾的数组元素
+_TRAILING_COMMA = re.compile(rb',\s*\]')
+
+
+def decode_response(content):
+    """
+    解析API响应内容，返回 (data, repaired)
+    repaired表示是否经过了格式修复，无法解析时抛出ValueError
+    """
+    try:
+        return _loads(content), False
+    except ValueError as e:
+        error = e
+
+    fixed = _TRAILING_COMMA.sub(b']', _LEADING_COMMA.sub(b'[', content))
+    if fixed != content:
+        try:
+            return _loads(fixed), True
+        except ValueError as fix_error:
+            logger.error(f"尝试修复JSON失败: {str(fix_error)}")
+
+    raise ValueError(f"API返回非JSON数据: {str(error)}") from error
+
+
+def _is_true(value):
+    """
+    判断API返回的布尔值
+    """
+    return str(value).lower() == 'true' if value is not None else False
+
+
+def _text(value, default):
+    # 空值统一替换为友好的提示信息
+    if value is None:
+        return default
+    value = str(value).strip()
+    return value or default
+
+
+class YunheiVerdict:
+    """
+    单个用户的云黑查询结果，只保留 info[2] 中需要的字段
+    """
+
+    __slots__ = ('id', 'blacklisted', 'reason', 'type', 'admin', 'level', 'date')
+
+    def __init__(self, user_id, blacklisted, reason="无说明", type_="未知", admin="未知", level="无", date="无记录"):
+        self.id = str(user_id)
+        self.blacklisted = blacklisted
+        self.reason = reason
+        self.type = type_
+        self.admin = admin
+        self.level = level
+        self.date = date
+
+    @classmethod
+    def from_info(cls, user_id, info):
+        """
+        从API返回的云黑记录（info[2]）构建，空字段在此统一规范化
+        """
+        return cls(
+            user_id,
+            _is_true(info.get('yh')),
+            _text(info.get('note'), "无说明"),
+            _text(info.get('type'), "未知"),
+            _text(info.get('admin'), "未知"),
+            _text(info.get('level'), "无"),
+            _text(info.get('date'), "无记录"),
+        )
+
+    def to_info(self):
+        """
+        转换回 info[2] 格式，用于写入缓存
+        """
+        return {
+            'yh': 'true' if self.blacklisted else 'false',
+            'note': self.reason,
+            'type': self.type,
+            'admin': self.admin,
+            'level': self.level,
+            'date': self.date,
+        }
+
+    def to_member(self):
+        """
+        转换为成员信息字典，供图片生成扩展等使用
+        """
+        return {
+            'id': self.id,
+            'reason': self.reason,
+            'type': self.type,
+            'admin': self.admin,
+            'level': self.level,
+            'date': self.date,
+        }
+
+    def __repr__(self):
+        return f"YunheiVerdict(id={self.id!r}, blacklisted={self.blacklisted!r}, reason={self.reason!r})"
+
+
+def extract_verdict(user_id, data):
+    """
+    从API响应中提取用户的云黑记录，数据为空或格式不正确时返回None
+    """
+    # 检查返回数据是否为空或无效
+    if not data:
+        logger.warning(f"查询成员 {user_id} 返回空数据")
+        return None
+
+    info_list = data.get("info") if isinstance(data, dict) else None
+    if not info_list:
+        logger.warning(f"用户 {user_id} 的查询返回空数据")
+        return None
+
+    # 确保info_list至少有3个元素且第三个元素是字典类型
+    if len(info_list) < 3 or not isinstance(info_list[2], dict):
+        logger.warning(f"用户 {user_id} 的查询返回数据格式不正确: {info_list}")
+        return None
+
+    return YunheiVerdict.from_info(user_id, info_list[2])
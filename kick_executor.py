@@ -0,0 +1,94 @@
+import asyncio
+
+from astrbot.api import logger
+
+from .scheduler import RateScheduler, PRIORITY_JOIN, PRIORITY_SCAN
+from .transport import full_jitter_backoff
+
+# OneBot明确拒绝的返回码（参数错误、无权限、不支持等），重试也不会成功
+PERMANENT_RETCODES = {100, 102, 104, 201, 1400, 1401, 1403, 1404}
+
+
+def is_transient_kick_error(error):
+    """
+    判断踢人失败是否为可重试的临时错误
+    带返回码的OneBot错误只有不在永久错误列表中时才重试，网络错误和超时总是重试
+    """
+    retcode = getattr(error, "retcode", None)
+    if retcode is not None:
+        try:
+            return int(retcode) not in PERMANENT_RETCODES
+        except (TypeError, ValueError):
+            return True
+    return True
+
+
+class KickExecutor:
+    """
+    踢出成员执行器
+    限制同时进行的踢人请求数，并对OneBot端单独做频率限制，临时错误按带抖动的指数退避重试。
+    先按优先级获取频率令牌，再占用并发名额，退避等待期间不占用名额；
+    进群踢出使用单独的并发名额，不会排在大量确认踢出之后
+    """
+
+    def __init__(self, concurrency=5, max_requests=10, time_window=1, max_retries=3, backoff_base=0.5, backoff_max=8,
+                 metrics=None):
+        self.max_retries = max_retries
+        self.metrics = metrics
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._join_semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.rate_scheduler = RateScheduler(max_requests, time_window)
+
+    async def kick(self, bot, group_id, user_id, reject_add_request=False, priority=PRIORITY_SCAN):
+        """
+        踢出单个成员，成功返回None，最终失败时返回最后一次的异常
+        """
+        last_error = None
+        semaphore = self._join_semaphore if priority == PRIORITY_JOIN else self._semaphore
+        for attempt in range(self.max_retries + 1):
+            await self.rate_scheduler.acquire(priority, group_id)
+            try:
+                async with semaphore:
+                    await bot.set_group_kick(
+                        group_id=int(group_id),
+                        user_id=int(user_id),
+                        reject_add_request=reject_add_request
+                    )
+                return None
+            except Exception as e:
+                last_error = e
+                if attempt >= self.max_retries or not is_transient_kick_error(e):
+                    break
+                delay = full_jitter_backoff(attempt, self.backoff_base, self.backoff_max)
+                if self.metrics:
+                    self.metrics.inc("kick_retries_total")
+                logger.warning(f"踢出成员 {user_id} 失败，{delay:.2f} 秒后重试（第 {attempt + 1} 次）: {str(e)}")
+                await asyncio.sleep(delay)
+        return last_error
+
+    async def kick_now(self, bot, group_id, user_id, reject_add_request=False):
+        """
+        以最高优先级踢出单个成员，用于进群自动踢出
+        """
+        return await self.kick(bot, group_id, user_id, reject_add_request, priority=PRIORITY_JOIN)
+
+    async def iter_kick(self, bot, group_id, user_ids, reject_add_request=False):
+        """
+        并发踢出多个成员，每完成一个就产出 (user_id, error)，成功时error为None
+        """
+        async def run(user_id):
+            return user_id, await self.kick(bot, group_id, user_id, reject_add_request)
+
+        tasks = [asyncio.ensure_future(run(user_id)) for user_id in user_ids]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # 调用方提前结束迭代时取消剩余的踢人任务
+            for task in tasks:
+                task.cancel()
+
+    async def close(self):
+        await self.rate_scheduler.close()
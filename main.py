@@ -2,187 +2,605 @@ from astrbot.api.event import filter, AstrMessageEvent, MessageEventResult
 from astrbot.api.star import Context, Star, register
 from astrbot.api import logger, AstrBotConfig
 import astrbot.api.message_components as message_components
-import httpx
 import asyncio
+import importlib.util
+import inspect
+import os
 import time
-from collections import deque
 
-@register("asbot_plugin_furry-API-hy", "furryhm", "调用趣绮梦云黑API的群黑云查询踢出还有进群自动检测黑云有问题自动踢出的插件", "3.5.1")
+from .cache import VerdictCache
+from .scheduler import RateScheduler, PRIORITY_JOIN, PRIORITY_SCAN, PRIORITY_NAMES
+from .kick_executor import KickExecutor
+from .decoder import decode_response, extract_verdict, YunheiVerdict
+from .metrics import PluginMetrics, DURATION_BUCKETS, write_text_atomic
+from .snapshot import MemberSnapshotStore
+from .mirror import BlacklistMirror
+from .transport import ResilientHttpClient, CircuitOpenError
+from .policy import GroupPolicyIndex
+from .pending import PendingKickStore
+from .coordination import SharedRateWindow
+from .report import render_pages, build_forward_messages
+
+PLUGIN_NAME = "asbot_plugin_furry-API-hy"
+# 图片生成扩展插件的入口文件
+IMAGE_EXTENSION_PATH = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', 'asbot_plugin_furry-API-hykz', 'main.py')
+)
+# 查询结果写入缓存前的合并等待时间（秒）
+CACHE_FLUSH_DELAY = 0.5
+
+
+def _get_data_dir():
+    """
+    获取插件数据目录，旧版本AstrBot没有StarTools.get_data_dir时使用默认路径
+    """
+    try:
+        from astrbot.api.star import StarTools
+        return str(StarTools.get_data_dir(PLUGIN_NAME))
+    except Exception:
+        data_dir = os.path.join("data", "plugin_data", PLUGIN_NAME)
+        os.makedirs(data_dir, exist_ok=True)
+        return data_dir
+
+
+@register(PLUGIN_NAME, "furryhm", "调用趣绮梦云黑API的群黑云查询踢出还有进群自动检测黑云有问题自动踢出的插件", "3.5.1")
 class QimengYunheiPlugin(Star):
     def __init__(self, context: Context, config: AstrBotConfig):
         super().__init__(context)
         self.config = config
-        # 存储待踢出的云黑成员列表
-        self.pending_kick_members = {}
         # 群白名单存储 {group_id: [user_id, ...]}
         self.group_whitelist = {}
         # API请求频率限制相关
-        self.request_timestamps = deque()
         self.max_requests = 20
         self.time_window = 5  # 秒
-        # 创建一个共享的httpx客户端
-        self.http_client = httpx.AsyncClient(timeout=10)
+        # 运行指标
+        self.metrics = self._create_metrics()
+        # 后台任务，插件卸载时统一取消
+        self._background_tasks = set()
+        # 多进程共享目录，设置后频率窗口和查询缓存由同一台机器上的所有机器人进程共用
+        self.shared_state_dir = self.config.get("shared_state_dir", "")
+        self.shared_rate_window = None
+        if self.shared_state_dir:
+            try:
+                self.shared_rate_window = SharedRateWindow(
+                    os.path.join(self.shared_state_dir, "rate_window.db"),
+                    self.max_requests,
+                    self.time_window,
+                    safety_margin=self.config.get("rate_limit_margin", 0.3)
+                )
+                logger.info(f"已启用多进程共享频率限制: {self.shared_state_dir}")
+            except Exception as e:
+                logger.error(f"初始化共享频率窗口失败，将只按本进程限制: {str(e)}")
+        # 带优先级的请求调度器，进群检测优先于批量扫描
+        self.rate_scheduler = RateScheduler(
+            self.max_requests,
+            self.time_window,
+            safety_margin=self.config.get("rate_limit_margin", 0.3),
+            shared_window=self.shared_rate_window
+        )
+        # 正在进行中的查询 {user_id: (priority, task)}，用于合并同一用户的并发查询
+        self._inflight_lookups = {}
+        # 最近一次收到的事件对应的机器人客户端，后台任务无法获取平台时使用
+        self._last_bot = None
+        # 已加载的图片生成扩展 (mtime, module)
+        self._image_extension = None
+        # 进群检测的合并窗口 {user_id: (group_id, [future, ...])}
+        self._join_batch = {}
+        self._join_batch_tasks = set()
+        # 进群时命中本地云黑库、正在后台向API复核的用户
+        self._mirror_rechecks = set()
+        # 等待写入缓存的查询结果 {user_id: verdict}，合并后在线程池中一次提交
+        self._cache_writes = {}
+        self._cache_flush_task = None
+        # 踢出成员执行器，对OneBot端单独限流并重试临时错误
+        self.kick_executor = KickExecutor(
+            concurrency=self.config.get("kick_concurrency", 5),
+            max_requests=self.config.get("kick_rate_limit", 10),
+            time_window=self.config.get("kick_rate_window", 1),
+            max_retries=self.config.get("kick_max_retries", 3),
+            metrics=self.metrics
+        )
+        # 创建一个共享的HTTP客户端，带连接池、超时、重试和熔断
+        self.http_client = ResilientHttpClient(
+            max_connections=self.config.get("http_max_connections", 20),
+            max_keepalive_connections=self.config.get("http_max_keepalive", 20),
+            keepalive_expiry=self.config.get("http_keepalive_expiry", 30),
+            connect_timeout=self.config.get("http_connect_timeout", 3),
+            read_timeout=self.config.get("http_read_timeout", 8),
+            max_retries=self.config.get("http_max_retries", 2),
+            failure_threshold=self.config.get("circuit_failure_threshold", 5),
+            recovery_timeout=self.config.get("circuit_recovery_timeout", 30),
+            metrics=self.metrics
+        )
         
-        # 获取启用云黑检测的群列表
-        self.enabled_groups = self.config.get("enabled_groups", [])
-        # 获取群组配置，用于存储每个群组的独立配置
-        self.group_configs = self.config.get("group_configs", {})
-        # 获取启用进群自动检测云黑功能的群白名单
-        self.auto_check_whitelist = self.config.get("auto_check_whitelist", [])
+        # 按启用群列表、进群检测白名单和群独立配置预先生成的群策略索引
+        self.group_policies = None
+        self._reload_group_policies()
+
+        # 云黑查询结果缓存，重启后依然有效
+        self.verdict_cache = None
+        if self.config.get("cache_enabled", True):
+            try:
+                self.verdict_cache = VerdictCache(
+                    os.path.join(self.shared_state_dir or _get_data_dir(), "verdict_cache.db"),
+                    blacklist_ttl=self.config.get("cache_blacklist_ttl", 86400),
+                    clean_ttl=self.config.get("cache_clean_ttl", 21600),
+                    max_entries=self.config.get("cache_max_entries", 50000),
+                    # 共享目录中的缓存可能被其他进程锁住，不长时间等待
+                    timeout=1.0 if self.shared_state_dir else 5.0
+                )
+            except Exception as e:
+                logger.error(f"初始化云黑缓存失败，将不使用缓存: {str(e)}")
+                self.verdict_cache = None
+
+        # 本地云黑库镜像，已知云黑ID无需请求API即可判定，API不可用时依然有效
+        self.blacklist_mirror = None
+        self._api_degraded = False
+        # 合并、导入、导出本地云黑库时互斥，避免线程池读取索引时索引被替换
+        self._mirror_lock = asyncio.Lock()
+        if self.config.get("mirror_enabled", True):
+            try:
+                self.blacklist_mirror = BlacklistMirror(os.path.join(_get_data_dir(), "blacklist_mirror.bin"))
+                logger.info(f"已加载本地云黑库，共 {len(self.blacklist_mirror)} 条记录")
+            except Exception as e:
+                logger.error(f"初始化本地云黑库失败: {str(e)}")
+
+        # 待确认踢出的云黑成员列表，有效期内发送「确认踢出」才会执行，可选保存到本地
+        self.pending_kicks = self._create_pending_store()
+        self._start_background_task(self._purge_pending_kicks_loop())
+
+        # 群成员快照，用于增量扫描
+        self.member_snapshot = None
+        try:
+            self.member_snapshot = MemberSnapshotStore(os.path.join(_get_data_dir(), "member_snapshot.db"))
+        except Exception as e:
+            logger.error(f"初始化群成员快照失败，增量扫描将检查全部成员: {str(e)}")
+
+        # 定期在后台对已配置的群进行增量扫描
+        if self.config.get("auto_sweep_enabled", False):
+            self._start_background_task(self._auto_sweep_loop())
+
+        # 定期导出Prometheus文本格式的指标文件
+        self.metrics_export_path = self.config.get("metrics_export_path", "")
+        if self.metrics_export_path:
+            self._start_background_task(self._export_metrics_loop())
+
+    def _reload_group_policies(self):
+        """
+        根据当前配置重建群策略索引，配置修改后AstrBot重新加载插件时会重新调用
+        """
+        self.group_policies = GroupPolicyIndex(self.config)
+        logger.info(f"群策略已加载，{len(self.group_policies)} 个群启用进群检测")
+
+    def _create_pending_store(self):
+        ttl = max(1, self.config.get("pending_kick_ttl", 30))
+        max_groups = self.config.get("pending_kick_max_groups", 200)
+        if self.config.get("pending_kick_persist", True):
+            try:
+                return PendingKickStore(
+                    ttl, max_groups, db_path=os.path.join(_get_data_dir(), "pending_kicks.db")
+                )
+            except Exception as e:
+                logger.error(f"初始化待踢出列表存储失败，将只保存在内存中: {str(e)}")
+        return PendingKickStore(ttl, max_groups)
 
-    async def _rate_limited_request(self, url):
+    async def _purge_pending_kicks_loop(self):
+        """
+        定期清理过期的待踢出列表
+        """
+        interval = min(60, max(5, self.pending_kicks.ttl))
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                purged = self.pending_kicks.purge_expired()
+                if purged:
+                    logger.debug(f"已清理 {purged} 个过期的待踢出列表")
+            except Exception as e:
+                logger.error(f"清理待踢出列表失败: {str(e)}")
+
+    def _create_metrics(self):
+        metrics = PluginMetrics()
+        metrics.describe("api_request_seconds", "API请求耗时（不含排队）")
+        metrics.describe("api_requests_total", "API请求次数")
+        metrics.describe("api_errors_total", "API请求失败次数（重试用尽后）")
+        metrics.describe("api_retries_total", "API请求重试次数")
+        metrics.describe("circuit_rejected_total", "熔断期间被直接拒绝的请求数")
+        metrics.describe("api_throttled_total", "API返回429限流的次数")
+        metrics.describe("json_repaired_total", "修复格式错误JSON的次数")
+        metrics.describe("json_errors_total", "JSON解析失败次数")
+        metrics.describe("rate_limit_wait_seconds", "请求在频率限制队列中的等待时间")
+        metrics.describe("cache_hits_total", "云黑缓存命中次数")
+        metrics.describe("cache_misses_total", "云黑缓存未命中次数")
+        metrics.describe("lookup_shared_total", "与进行中的查询合并的次数")
+        metrics.describe("mirror_hits_total", "本地云黑库命中次数")
+        metrics.describe("scan_duration_seconds", "大扫除耗时", buckets=DURATION_BUCKETS)
+        metrics.describe("scan_last_duration_seconds", "各群最近一次大扫除耗时")
+        metrics.describe("scan_members_total", "大扫除检查的成员数")
+        metrics.describe("kicks_total", "踢出成员次数")
+        metrics.describe("kick_retries_total", "踢出成员重试次数")
+        return metrics
+
+    def _start_background_task(self, coro):
+        """
+        启动后台任务，插件卸载时会被取消
+        """
+        try:
+            task = asyncio.get_running_loop().create_task(coro)
+        except RuntimeError:
+            coro.close()
+            logger.warning("当前没有运行中的事件循环，后台任务未启动")
+            return None
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def _export_metrics_loop(self):
+        interval = max(5, self.config.get("metrics_export_interval", 60))
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                # 在事件循环中渲染，避免线程池遍历指标时事件循环新增标签序列
+                text = self.metrics.render_prometheus()
+                await asyncio.get_running_loop().run_in_executor(
+                    None, write_text_atomic, self.metrics_export_path, text
+                )
+            except Exception as e:
+                logger.error(f"导出运行指标失败: {str(e)}")
+
+    async def _rate_limited_request(self, url, priority=PRIORITY_SCAN, group_id=None):
         """
         带频率限制的API请求
-        限制为20次请求/5秒
+        限制为20次请求/5秒，由调度器按优先级和群组公平发放请求额度
         """
-        current_time = time.time()
-        
-        # 清除时间窗口外的请求记录
-        while self.request_timestamps and self.request_timestamps[0] < current_time - self.time_window:
-            self.request_timestamps.popleft()
-        
-        # 如果当前窗口内的请求数已达到上限，则等待
-        if len(self.request_timestamps) >= self.max_requests:
-            oldest_request_time = self.request_timestamps[0]
-            sleep_time = self.time_window - (current_time - oldest_request_time)
-            if sleep_time > 0:
-                logger.debug(f"达到频率限制，等待 {sleep_time:.2f} 秒")
-                await asyncio.sleep(sleep_time)
-                # 再次清理过期的请求记录
-                current_time = time.time()
-                while self.request_timestamps and self.request_timestamps[0] < current_time - self.time_window:
-                    self.request_timestamps.popleft()
-        
-        # 记录当前请求时间
-        self.request_timestamps.append(current_time)
-        logger.debug(f"发起API请求，当前窗口请求数: {len(self.request_timestamps)}")
+        async def acquire():
+            waited = await self.rate_scheduler.acquire(priority, group_id)
+            self.metrics.observe("rate_limit_wait_seconds", waited, priority=PRIORITY_NAMES.get(priority, priority))
         
-        # 发起请求
-        response = await self.http_client.get(url)
-        response.raise_for_status()
+        # 发起请求，每次重试都重新获取请求额度；熔断期间直接失败，不占用额度
+        try:
+            response = await self.http_client.get(url, before_attempt=acquire)
+        except Exception:
+            self.metrics.inc("api_errors_total")
+            raise
         
         # 检查响应内容是否为空
         if not response.content:
             logger.warning(f"API返回空响应: {url}")
             return {}
             
-        # 尝试解析JSON
+        # 解析JSON，格式错误时尝试修复
         try:
-            return response.json()
-        except Exception as e:
-            # 尝试修复格式错误的JSON
-            response_text = response.text
-            if response_text:
-                # 修复无效的JSON格式（如 [,{} ] 这种情况）
-                import re
-                # 修复以逗号开头的数组元素
-                response_text = re.sub(r'\[\s*,', '[', response_text)
-                # 修复以逗号结尾的数组元素
-                response_text = re.sub(r',\s*\]', ']', response_text)
-                
-                try:
-                    import json
-                    fixed_data = json.loads(response_text)
-                    logger.warning(f"已修复格式错误的JSON: {url}")
-                    return fixed_data
-                except Exception as fix_error:
-                    logger.error(f"尝试修复JSON失败: {str(fix_error)}")
-            
+            data, repaired = decode_response(response.content)
+        except ValueError:
+            self.metrics.inc("json_errors_total")
             logger.error(f"API响应JSON解析失败，响应内容: {response.text}")
-            raise ValueError(f"API返回非JSON数据: {str(e)}") from e
+            raise
+        if repaired:
+            self.metrics.inc("json_repaired_total")
+            logger.debug(f"已修复格式错误的JSON: {url}")
+        return data
 
-    async def _batch_check_users(self, user_ids, api_key, batch_size=20):
+    async def _query_user_info(self, user_id, api_key, priority=PRIORITY_SCAN, group_id=None, check_cache=True):
         """
-        批量检查用户云黑状态
+        查询单个用户的云黑记录，优先使用缓存
+        调用方已经批量读取过缓存时传入check_cache=False，不再重复读取数据库
+        返回YunheiVerdict，返回数据为空或格式不正确时返回None
+        """
+        if self.verdict_cache is not None:
+            # 刚查询到、尚未写入缓存的结果
+            pending = self._cache_writes.get(str(user_id))
+            if pending is not None:
+                self.metrics.inc("cache_hits_total")
+                return pending
+        if self.verdict_cache is not None and check_cache:
+            # 缓存读取可能等待数据库锁，在线程池中执行，不阻塞事件循环
+            try:
+                cached = await asyncio.get_running_loop().run_in_executor(None, self.verdict_cache.get, user_id)
+            except Exception as e:
+                logger.error(f"读取云黑缓存失败: {str(e)}")
+                cached = None
+            if cached is not None:
+                self.metrics.inc("cache_hits_total")
+                logger.debug(f"用户 {user_id} 命中云黑缓存")
+                return YunheiVerdict.from_info(user_id, cached)
+            self.metrics.inc("cache_misses_total")
+
+        # API不可用时，本地云黑库中的已知云黑ID直接判定；API正常时以API结果为准
+        if self._api_unavailable():
+            verdict = self._mirror_verdict(user_id)
+            if verdict is not None:
+                return verdict
+
+        # 同一用户同时只发起一个请求，其余调用共享结果；
+        # 若已有的请求优先级更低（如大扫除排队中），则以更高优先级单独发起并替换
+        key = str(user_id)
+        entry = self._inflight_lookups.get(key)
+        if entry is None or priority < entry[0]:
+            task = asyncio.ensure_future(self._fetch_user_info(user_id, api_key, priority, group_id))
+            entry = (priority, task)
+            self._inflight_lookups[key] = entry
+
+            def _release(_, key=key, entry=entry):
+                if self._inflight_lookups.get(key) is entry:
+                    del self._inflight_lookups[key]
+            task.add_done_callback(_release)
+        else:
+            self.metrics.inc("lookup_shared_total")
+            logger.debug(f"用户 {user_id} 已有查询在进行中，共享该请求结果")
+        # shield避免某个调用方被取消时连带取消其他调用方共享的请求
+        return await asyncio.shield(entry[1])
+
+    def _api_unavailable(self):
+        """
+        API是否处于不可用状态（最近请求失败或熔断中）
+        """
+        breaker = self.http_client.breaker
+        return self._api_degraded or breaker.state != breaker.CLOSED
+
+    def _circuit_open(self):
+        breaker = self.http_client.breaker
+        return breaker.state == breaker.OPEN
+
+    def _mirror_verdict(self, user_id):
+        """
+        从本地云黑库判定，不在库中时返回None
+        """
+        if self.blacklist_mirror is None or user_id not in self.blacklist_mirror:
+            return None
+        self.metrics.inc("mirror_hits_total")
+        logger.debug(f"用户 {user_id} 命中本地云黑库")
+        return YunheiVerdict(user_id, True, reason="本地云黑库记录")
+
+    async def _merge_blacklist_mirror(self, extra_ids=()):
+        """
+        在线程池中生成合并后的本地云黑库索引，再在事件循环中替换
+        """
+        mirror = self.blacklist_mirror
+        async with self._mirror_lock:
+            added, removed = mirror.pending_changes()
+            tmp_path = await asyncio.get_running_loop().run_in_executor(
+                None, mirror.build_index, added, removed, extra_ids
+            )
+            mirror.install_index(tmp_path, added, removed)
+        logger.debug(f"本地云黑库合并完成，共 {len(mirror)} 条记录")
+
+    async def _fetch_user_info(self, user_id, api_key, priority=PRIORITY_SCAN, group_id=None):
+        """
+        请求API获取单个用户的云黑记录并写入缓存
+        """
+        api_url = f"https://fz.qimeng.fun/OpenAPI/all_f.php?id={user_id}&key={api_key}"
+        try:
+            data = await self._rate_limited_request(api_url, priority, group_id)
+        except Exception:
+            if not self._api_degraded:
+                self._api_degraded = True
+                logger.warning("云黑API请求失败，进入离线模式：仅能通过本地云黑库和缓存判定")
+            verdict = self._mirror_verdict(user_id)
+            if verdict is not None:
+                return verdict
+            raise
+        if self._api_degraded:
+            self._api_degraded = False
+            logger.info("云黑API已恢复，退出离线模式")
+
+        verdict = extract_verdict(user_id, data)
+        if verdict is not None and self.verdict_cache is not None:
+            self._cache_writes[str(user_id)] = verdict
+            if self._cache_flush_task is None:
+                self._cache_flush_task = asyncio.ensure_future(self._flush_cache_writes())
+        # 用API的结果更新本地云黑库：确认的云黑记录加入，已移出云黑的用户删除
+        mirror = self.blacklist_mirror
+        if verdict is not None and mirror is not None:
+            try:
+                if verdict.blacklisted:
+                    mirror.add(user_id)
+                elif mirror.discard(user_id):
+                    logger.info(f"用户 {user_id} 已不在云黑中，已从本地云黑库移除")
+                if mirror.needs_merge() and not self._mirror_lock.locked():
+                    self._start_background_task(self._merge_blacklist_mirror())
+            except Exception as e:
+                logger.error(f"更新本地云黑库失败: {str(e)}")
+        return verdict
+
+    async def _flush_cache_writes(self):
+        """
+        把短时间内查询到的结果合并为一个事务，在线程池中写入缓存
+        共享目录中的缓存可能被其他进程锁住，写入不占用事件循环，也不拖慢查询
+        """
+        try:
+            await asyncio.sleep(CACHE_FLUSH_DELAY)
+            while self._cache_writes:
+                batch, self._cache_writes = self._cache_writes, {}
+                entries = [(user_id, verdict.to_info(), verdict.blacklisted) for user_id, verdict in batch.items()]
+                try:
+                    await asyncio.get_running_loop().run_in_executor(None, self.verdict_cache.set_many, entries)
+                except Exception as e:
+                    logger.error(f"写入 {len(entries)} 条云黑缓存失败: {str(e)}")
+        finally:
+            self._cache_flush_task = None
+
+    async def _recheck_mirror_hit(self, user_id, api_key, group_id=None):
+        """
+        向API复核命中本地云黑库的用户，已移出云黑的用户会在查询结果中从本地云黑库删除
+        """
+        try:
+            await self._query_user_info(user_id, api_key, PRIORITY_SCAN, group_id, check_cache=False)
+        except Exception as e:
+            logger.debug(f"复核本地云黑库用户 {user_id} 失败: {str(e)}")
+        finally:
+            self._mirror_rechecks.discard(user_id)
+
+    async def _check_join_user(self, user_id, api_key, group_id=None):
+        """
+        查询新成员的云黑记录
+        短时间内的进群事件会被合并为一批统一调度，同一用户在多个群同时进群只查询一次，
+        每个调用方在自己的用户结果返回后立即继续处理。
+        本地云黑库中的已知云黑ID直接判定，不占用API额度，之后在后台以大扫除优先级向API复核
+        """
+        verdict = self._mirror_verdict(user_id)
+        if verdict is not None:
+            key = str(user_id)
+            if key not in self._mirror_rechecks and not self._api_unavailable():
+                self._mirror_rechecks.add(key)
+                self._start_background_task(self._recheck_mirror_hit(key, api_key, group_id))
+            return verdict
+
+        window = self.config.get("join_batch_window", 0.3)
+        if window <= 0:
+            return await self._query_user_info(user_id, api_key, PRIORITY_JOIN, group_id)
+
+        future = asyncio.get_running_loop().create_future()
+        # 当前窗口的第一个事件负责安排本批的查询
+        if not self._join_batch:
+            task = asyncio.ensure_future(self._flush_join_batch(api_key, window))
+            self._join_batch_tasks.add(task)
+            task.add_done_callback(self._join_batch_tasks.discard)
+        self._join_batch.setdefault(str(user_id), (group_id, []))[1].append(future)
+        return await future
+
+    async def _flush_join_batch(self, api_key, window):
+        """
+        等待合并窗口结束后统一查询本批进群用户
+        """
+        await asyncio.sleep(window)
+        batch, self._join_batch = self._join_batch, {}
+        if len(batch) > 1:
+            logger.debug(f"合并 {len(batch)} 个进群用户为一批进行云黑检测")
+
+        # 按进群的群分组调度，保持调度器在各群之间轮流分配额度
+        group_users = {}
+        for user_id, (group_id, _) in batch.items():
+            group_users.setdefault(group_id, []).append(user_id)
+
+        async def check_group(group_id, user_ids):
+            # 各群互不影响，一个群出错时其他群的查询继续进行
+            try:
+                async for user_id, verdict in self._iter_check_users(
+                    user_ids, api_key, concurrency=self.max_requests, group_id=group_id, priority=PRIORITY_JOIN
+                ):
+                    _, futures = batch.pop(str(user_id), (None, []))
+                    for future in futures:
+                        if not future.done():
+                            future.set_result(verdict)
+            except Exception as e:
+                logger.error(f"群 {group_id} 进群批量检测时出错: {str(e)}")
+
+        try:
+            await asyncio.gather(*[check_group(group_id, user_ids) for group_id, user_ids in group_users.items()])
+        finally:
+            # 被过滤掉的无效ID或异常中断时，让剩余的调用方也能结束等待
+            for _, futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_result(None)
+
+    def _collect_blacklisted(self, verdict, blacklisted_members):
+        """
+        如果是云黑成员则加入结果列表
+        """
+        if verdict.blacklisted:
+            blacklisted_members.append(verdict)
+            logger.info(f"发现云黑成员: {verdict.id}, 原因: {verdict.reason}")
+        else:
+            logger.debug(f"用户 {verdict.id} 不是云黑成员")
+
+    def _filter_valid_user_ids(self, user_ids):
+        """
+        过滤掉无效的用户ID（如空字符串、None、0或负数或位数少于5位），并去重保持原有顺序
         """
-        blacklisted_members = []
-        
-        # 过滤掉无效的用户ID（如空字符串、None、0或负数或位数少于5位）
         valid_user_ids = [user_id for user_id in user_ids 
                          if user_id and str(user_id).strip() and int(user_id) > 0 and len(str(user_id)) >= 5]
+        return list(dict.fromkeys(valid_user_ids))
+
+    async def _iter_check_users(self, user_ids, api_key, concurrency=None, group_id=None, priority=PRIORITY_SCAN):
+        """
+        流式检查用户云黑状态
+        始终保持最多concurrency个请求在途，任一请求完成后立即发起下一个，
+        每完成一个用户就产出 (user_id, verdict)，查询失败或数据无效时verdict为None
+        """
+        if concurrency is None:
+            concurrency = self.config.get("scan_concurrency", 20)
+        concurrency = max(1, int(concurrency))
+
+        valid_user_ids = self._filter_valid_user_ids(user_ids)
         
-        # 记录开始批量检查
-        logger.info(f"开始批量检查 {len(valid_user_ids)} 个用户云黑状态，批量大小: {batch_size}")
+        # 记录开始批量检查，进群检测每次都会经过这里，只记录调试日志
+        log = logger.debug if priority == PRIORITY_JOIN else logger.info
+        log(f"开始检查 {len(valid_user_ids)} 个用户云黑状态，并发数: {concurrency}")
         
         # 如果没有有效用户ID，直接返回
         if not valid_user_ids:
-            logger.info("没有有效的用户ID需要检查")
-            return blacklisted_members
-        
-        # 使用集合来确保用户ID唯一性
-        processed_user_ids = set()
-        
-        # 分批处理用户ID
-        for i in range(0, len(valid_user_ids), batch_size):
-            batch = valid_user_ids[i:i + batch_size]
-            
-            logger.debug(f"正在处理批次 {i//batch_size + 1}，包含 {len(batch)} 个用户")
-            
-            # 为每批用户创建异步任务
-            tasks = []
-            for user_id in batch:
-                # 避免重复处理同一个用户
-                if user_id in processed_user_ids:
-                    continue
-                processed_user_ids.add(user_id)
-                
-                api_url = f"https://fz.qimeng.fun/OpenAPI/all_f.php?id={user_id}&key={api_key}"
-                task = self._rate_limited_request(api_url)
-                tasks.append((task, user_id))
-            
-            # 并发执行当前批次的任务
-            results = await asyncio.gather(*[task for task, _ in tasks], return_exceptions=True)
-            
-            # 处理结果
-            for (result, user_id), task_result in zip(tasks, results):
-                try:
-                    if isinstance(task_result, Exception):
-                        logger.error(f"查询成员 {user_id} 时出错: {str(task_result)}")
-                        continue
-                    
-                    data = task_result
-                    # 检查返回数据是否为空或无效
-                    if not data:
-                        logger.warning(f"查询成员 {user_id} 返回空数据")
-                        continue
-                        
-                    # 解析返回数据
-                    if data.get("info"):
-                        info_list = data.get("info", [])
-                        # 确保info_list至少有3个元素且第三个元素是字典类型
-                        if len(info_list) >= 3 and isinstance(info_list[2], dict):
-                            yunhei_info = info_list[2]  # 云黑记录信息
-                            
-                            # 辅助函数用于判断布尔值
-                            def is_true(value):
-                                return str(value).lower() == 'true' if value is not None else False
-                                
-                            # 检查是否为云黑成员
-                            if is_true(yunhei_info.get('yh')):
-                                # 保存云黑成员信息
-                                blacklisted_member = {
-                                    'id': user_id,
-                                    'reason': yunhei_info.get('note', '无说明'),
-                                    'type': yunhei_info.get('type', '未知'),
-                                    'admin': yunhei_info.get('admin', '未知'),
-                                    'level': yunhei_info.get('level', '无'),
-                                    'date': yunhei_info.get('date', '无记录')
-                                }
-                                blacklisted_members.append(blacklisted_member)
-                                logger.info(f"发现云黑成员: {user_id}, 原因: {blacklisted_member['reason']}")
-                            else:
-                                logger.debug(f"用户 {user_id} 不是云黑成员")
-                        else:
-                            logger.warning(f"用户 {user_id} 的查询返回数据格式不正确: {info_list}")
+            log("没有有效的用户ID需要检查")
+            return
+
+        # 先从缓存中取出最近检查过的用户，只对未命中的用户发起请求
+        pending_user_ids = valid_user_ids
+        cache_checked = False
+        if self.verdict_cache is not None:
+            try:
+                cached = await asyncio.get_running_loop().run_in_executor(
+                    None, self.verdict_cache.get_many, valid_user_ids
+                )
+                cache_checked = True
+            except Exception as e:
+                logger.error(f"读取云黑缓存失败: {str(e)}")
+                cached = {}
+            if cached:
+                self.metrics.inc("cache_hits_total", len(cached))
+                pending_user_ids = []
+                for user_id in valid_user_ids:
+                    cached_info = cached.get(str(user_id))
+                    if cached_info is None:
+                        pending_user_ids.append(user_id)
                     else:
-                        logger.warning(f"用户 {user_id} 的查询返回空数据")
-                except Exception as e:
-                    logger.error(f"处理成员 {user_id} 的查询结果时出错: {str(e)}")
-                    continue
-                    
-            # 在批次之间添加小延迟以避免触发API限制
-            if i + batch_size < len(valid_user_ids):
-                await asyncio.sleep(0.1)
+                        yield user_id, YunheiVerdict.from_info(user_id, cached_info)
+            if cache_checked:
+                self.metrics.inc("cache_misses_total", len(pending_user_ids))
+            logger.debug(f"云黑缓存命中 {len(cached)} 个用户，需要请求API的用户: {len(pending_user_ids)}")
+
+        remaining = iter(pending_user_ids)
+        in_flight = {}
+
+        def start_next():
+            user_id = next(remaining, None)
+            if user_id is None:
+                return False
+            # 未命中的用户已确认不在缓存中，查询时跳过单独的缓存读取
+            task = asyncio.ensure_future(
+                self._query_user_info(user_id, api_key, priority, group_id, check_cache=not cache_checked)
+            )
+            in_flight[task] = user_id
+            return True
+
+        try:
+            for _ in range(concurrency):
+                if not start_next():
+                    break
+            while in_flight:
+                done, _ = await asyncio.wait(in_flight.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    user_id = in_flight.pop(task)
+                    # 空出一个位置后立即补上下一个请求
+                    start_next()
+                    try:
+                        verdict = task.result()
+                    except Exception as e:
+                        logger.error(f"查询成员 {user_id} 时出错: {str(e)}")
+                        verdict = None
+                    yield user_id, verdict
+        finally:
+            # 调用方提前结束迭代时取消所有在途请求
+            for task in in_flight:
+                task.cancel()
+
+    async def _batch_check_users(self, user_ids, api_key, concurrency=None, group_id=None):
+        """
+        批量检查用户云黑状态
+        """
+        blacklisted_members = []
+        async for user_id, verdict in self._iter_check_users(user_ids, api_key, concurrency, group_id):
+            if verdict is not None:
+                self._collect_blacklisted(verdict, blacklisted_members)
                 
         logger.info(f"批量检查完成，共发现 {len(blacklisted_members)} 名云黑成员")
         return blacklisted_members
@@ -192,11 +610,16 @@ class QimengYunheiPlugin(Star):
         """
         处理群成员增加事件
         """
-        # 检查事件类型是否为群成员增加
+        # 所有消息都会经过这里，先用一次字典查询排除不是群成员增加的事件
         raw_message = event.message_obj.raw_message
-        if not (raw_message.get('post_type') == 'notice' and raw_message.get('notice_type') == 'group_increase'):
+        try:
+            if raw_message.get('notice_type') != 'group_increase':
+                return
+        except AttributeError:
+            # 其他平台的原始消息不是字典
             return
-            
+        self._last_bot = event.bot
+
         # 获取群组ID和新成员ID
         group_id = raw_message.get('group_id')
         user_id = raw_message.get('user_id')
@@ -207,19 +630,10 @@ class QimengYunheiPlugin(Star):
         # 统一转换group_id为整数类型用于比较
         group_id_int = int(group_id)
         
-        # 检查是否在启用云黑检测的群列表中
-        if self.enabled_groups and group_id_int not in self.enabled_groups:
-            logger.info(f"群 {group_id} 不在启用云黑检测的群列表中，跳过检测")
-            return
-            
-        # 检查是否在进群自动检测云黑功能的群白名单中
-        # 如果配置了白名单且当前群组不在白名单中，则不执行检测
-        if self.auto_check_whitelist and group_id_int not in [int(x) for x in self.auto_check_whitelist]:
-            logger.info(f"群 {group_id} 不在进群自动检测云黑功能的群白名单中，跳过检测")
-            return
-        # 如果没有配置白名单，则默认不执行检测（白名单为空时功能关闭）
-        elif not self.auto_check_whitelist:
-            logger.info("未配置进群自动检测云黑功能的群白名单，跳过检测")
+        # 查询该群的进群检测策略，未启用的群直接跳过
+        policy = self.group_policies.join_policy(group_id_int)
+        if policy is None:
+            logger.info(f"{self.group_policies.skip_reason(group_id_int)}，跳过检测")
             return
             
         # 检查API Key是否配置
@@ -229,78 +643,259 @@ class QimengYunheiPlugin(Star):
             return
             
         try:
-            # 构造API请求URL
-            api_url = f"https://fz.qimeng.fun/OpenAPI/all_f.php?id={user_id}&key={api_key}"
-            
-            logger.info(f"正在查询成员 {user_id} 的云黑状态，请求URL: {api_url}")
+            logger.debug(f"正在查询成员 {user_id} 的云黑状态")
             
-            # 发起API请求
-            data = await self._rate_limited_request(api_url)
-            
-            # 检查返回数据是否为空或无效
-            if not data:
-                logger.warning(f"查询成员 {user_id} 返回空数据")
+            # 查询云黑记录（优先使用缓存）
+            verdict = await self._check_join_user(user_id, api_key, str(group_id_int))
+            if verdict is None:
                 return
                 
-            # 解析返回数据
-            if data.get("info"):
-                info_list = data.get("info", [])
-                if len(info_list) >= 3:
-                    yunhei_info = info_list[2]  # 云黑记录信息
-                    
-                    # 辅助函数用于判断布尔值
-                    def is_true(value):
-                        return str(value).lower() == 'true' if value is not None else False
-                        
-                    # 构建API返回信息
-                    reason = yunhei_info.get('note', '无说明')
-                    type_ = yunhei_info.get('type', '未知')
-                    admin = yunhei_info.get('admin', '未知')
-                    level = yunhei_info.get('level', '无')
-                    date = yunhei_info.get('date', '无记录')
-                    
-                    # 如果是空字符串，则设置为"无"或友好的提示信息
-                    if not reason or reason.strip() == "":
-                        reason = "无说明"
-                    if not type_ or type_.strip() == "":
-                        type_ = "未知"
-                    if not admin or admin.strip() == "":
-                        admin = "未知"
-                    if not level or level.strip() == "":
-                        level = "无"
-                    if not date or date.strip() == "":
-                        date = "无记录"
-                    
-                    # 检查是否为云黑成员
-                    if is_true(yunhei_info.get('yh')):
-                        logger.info(f"检测到云黑成员: {user_id}，原因: {reason}，类型: {type_}，日期: {date}")
-                        
-                        # 踢出成员
-                        await event.bot.set_group_kick(
-                            group_id=group_id_int, 
-                            user_id=int(user_id), 
-                            reject_add_request=False
-                        )
-                        
-                        # 发送踢出通知消息
-                        kick_message = f"检测到云黑成员 {user_id} 已被自动踢出\n原因: {reason}\n类型: {type_}\n日期: {date}"
-                        yield event.plain_result(kick_message)
-                        
-                        logger.info(f"已踢出云黑成员: {user_id}，原因: {reason}，类型: {type_}\n日期: {date}")
-                    else:
-                        logger.info(f"成员 {user_id} 不是云黑用户，原因: {reason}，类型: {type_}，等级: {level}，日期: {date}")
-                        
-                        # 发送正常成员检测信息
-                        normal_message = f"新成员 {user_id} 不是云黑用户\n原因: {reason}\n类型: {type_}\n等级: {level}\n日期: {date}"
-                        yield event.plain_result(normal_message)
+            reason = verdict.reason
+            type_ = verdict.type
+            level = verdict.level
+            date = verdict.date
+            
+            # 检查是否为云黑成员
+            if verdict.blacklisted:
+                logger.info(f"检测到云黑成员: {user_id}，原因: {reason}，类型: {type_}，日期: {date}")
+                
+                # 群配置关闭自动踢出时只通知管理员
+                if not policy.auto_kick:
+                    if policy.should_notify(True):
+                        yield event.plain_result(f"检测到云黑成员 {user_id}，本群未开启自动踢出，请管理员处理\n原因: {reason}\n类型: {type_}\n日期: {date}")
+                    return
+                
+                # 踢出成员
+                kick_error = await self.kick_executor.kick_now(
+                    event.bot, group_id_int, user_id, reject_add_request=policy.reject_add_request
+                )
+                if kick_error is not None:
+                    self.metrics.inc("kicks_total", source="join", result="failure")
+                    logger.error(f"自动踢出云黑成员 {user_id} 失败: {str(kick_error)}")
+                    if policy.should_notify(True):
+                        yield event.plain_result(f"检测到云黑成员 {user_id}，但自动踢出失败，请管理员手动处理\n原因: {reason}\n类型: {type_}\n日期: {date}")
+                    return
+                
+                self.metrics.inc("kicks_total", source="join", result="success")
+                
+                # 发送踢出通知消息
+                if policy.should_notify(True):
+                    kick_message = f"检测到云黑成员 {user_id} 已被自动踢出\n原因: {reason}\n类型: {type_}\n日期: {date}"
+                    yield event.plain_result(kick_message)
+                
+                logger.info(f"已踢出云黑成员: {user_id}，原因: {reason}，类型: {type_}\n日期: {date}")
             else:
-                logger.info(f"查询成员 {user_id} 的云黑状态返回空数据")
+                logger.info(f"成员 {user_id} 不是云黑用户，原因: {reason}，类型: {type_}，等级: {level}，日期: {date}")
+                
+                # 发送正常成员检测信息
+                if policy.should_notify(False):
+                    normal_message = f"新成员 {user_id} 不是云黑用户\n原因: {reason}\n类型: {type_}\n等级: {level}\n日期: {date}"
+                    yield event.plain_result(normal_message)
                         
         except Exception as e:
             logger.error(f"检测新成员 {user_id} 云黑状态时出错: {str(e)}")
 
-    @filter.command("大扫除", "扫描所有群云黑成员，大扫除!")
-    async def scan_group_members(self, event: AstrMessageEvent):
+    def _exec_image_extension(self, plugin_path):
+        """
+        执行图片生成扩展模块（在线程池中调用）
+        """
+        spec = importlib.util.spec_from_file_location("asbot_plugin_furry_API_hykz.main", plugin_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    async def _load_image_extension(self):
+        """
+        加载图片生成扩展插件，模块只加载一次并缓存，文件修改时间变化时才重新加载
+        未安装扩展时返回None
+        """
+        try:
+            mtime = os.stat(IMAGE_EXTENSION_PATH).st_mtime
+        except OSError:
+            self._image_extension = None
+            return None
+        if self._image_extension is not None and self._image_extension[0] == mtime:
+            return self._image_extension[1]
+        module = await asyncio.get_running_loop().run_in_executor(None, self._exec_image_extension, IMAGE_EXTENSION_PATH)
+        self._image_extension = (mtime, module)
+        logger.info(f"已加载图片生成扩展: {IMAGE_EXTENSION_PATH}")
+        return module
+
+    async def _fetch_group_members(self, client, group_id):
+        """
+        获取群成员QQ号列表
+        """
+        members_data = await client.get_group_member_list(group_id=int(group_id))
+        # 提取成员QQ号列表，并过滤掉无效的用户ID（如0或负数或位数少于5位）
+        return [str(member['user_id']) for member in members_data 
+                if member['user_id'] > 0 and len(str(member['user_id'])) >= 5]
+
+    def _get_sweep_groups(self):
+        """
+        获取全局扫描的群列表：启用云黑检测的群与进群自动检测白名单的并集
+        """
+        return list(self.group_policies.sweep_groups)
+
+    def _get_bot_client(self):
+        """
+        获取OneBot客户端，用于没有消息事件的后台任务
+        """
+        try:
+            platform = self.context.get_platform("aiocqhttp")
+            if platform is not None:
+                return platform.get_client()
+        except Exception as e:
+            logger.debug(f"获取aiocqhttp平台失败: {str(e)}")
+        return self._last_bot
+
+    async def _auto_sweep_loop(self):
+        """
+        后台定期增量扫描所有已配置的群
+        每轮的扫描在整个间隔内均匀错开，使API额度被平稳使用而不是集中爆发
+        """
+        interval = max(60, self.config.get("auto_sweep_interval", 21600))
+        # 启动后先等待一段时间，避免与插件加载时的其他请求挤在一起
+        await asyncio.sleep(min(interval, 60))
+        while True:
+            group_ids = self._get_sweep_groups()
+            spacing = interval / max(1, len(group_ids))
+            for group_id in group_ids or [None]:
+                if group_id is not None:
+                    started = time.monotonic()
+                    try:
+                        await self._auto_sweep_group(group_id)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        logger.error(f"后台扫描群 {group_id} 时出错: {str(e)}")
+                    await asyncio.sleep(max(0, spacing - (time.monotonic() - started)))
+                else:
+                    await asyncio.sleep(interval)
+
+    async def _auto_sweep_group(self, group_id):
+        """
+        对单个群进行一次后台增量扫描
+        """
+        api_key = self.config.get("api_key", "")
+        client = self._get_bot_client()
+        if not api_key or client is None:
+            logger.debug("API Key未配置或暂无可用的机器人客户端，跳过后台扫描")
+            return
+
+        group_members = await self._fetch_group_members(client, group_id)
+        blacklisted_members = []
+        try:
+            async for _, _, blacklisted_members, _ in self._iter_scan_group(
+                group_id, group_members, api_key, incremental=True
+            ):
+                pass
+        except CircuitOpenError as e:
+            # 未检查的成员留到下一轮，已发现的云黑成员照常通知
+            logger.warning(str(e))
+
+        if not blacklisted_members:
+            return
+        ttl = self.pending_kicks.put(group_id, blacklisted_members, ttl=self._sweep_pending_ttl())
+        if self.config.get("auto_sweep_notify", True):
+            message = f"后台巡检发现 {len(blacklisted_members)} 名云黑成员：" + "、".join(
+                member.id for member in blacklisted_members[:20]
+            )
+            if len(blacklisted_members) > 20:
+                message += " 等"
+            message += f"\n如需踢出，请管理员在{self._format_ttl(ttl)}内发送命令：确认踢出"
+            await client.send_group_msg(group_id=int(group_id), message=message)
+
+    def _sweep_pending_ttl(self):
+        """
+        全局大扫除和后台巡检结果的确认有效期，管理员往往不会立即看到，默认比手动大扫除更长
+        """
+        return max(1, self.config.get("pending_kick_sweep_ttl", 3600))
+
+    @staticmethod
+    def _format_ttl(seconds):
+        seconds = int(seconds)
+        if seconds % 3600 == 0:
+            return f"{seconds // 3600}小时"
+        if seconds >= 60 and seconds % 60 == 0:
+            return f"{seconds // 60}分钟"
+        return f"{seconds}秒"
+
+    async def _iter_scan_group(self, group_id, group_members, api_key, incremental=False):
+        """
+        扫描单个群的成员，开始时和每检查完一名成员时产出 (已检查数, 需检查总数, 云黑成员列表, 查询失败数)
+        增量模式下只检查新进群的成员和超过incremental_max_age秒未检查的成员；
+        云黑成员不会被标记为已检查，仍在群内时每次增量扫描都会重新报告。
+        API熔断时剩余的查询都会直接失败，此时中止扫描并抛出CircuitOpenError
+        """
+        group_id = str(group_id)
+        to_check = group_members
+        snapshot = self.member_snapshot
+        if snapshot is not None:
+            # 大群的快照读写涉及上千行，在线程池中执行，不阻塞事件循环
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, snapshot.sync_members, group_id, group_members)
+                if incremental:
+                    max_age = self.config.get("incremental_max_age", 259200)
+                    to_check = await loop.run_in_executor(
+                        None, snapshot.select_stale, group_id, group_members, max_age
+                    )
+            except Exception as e:
+                logger.error(f"读取群 {group_id} 成员快照失败，将检查全部成员: {str(e)}")
+        elif incremental:
+            logger.warning("成员快照不可用，增量扫描将检查全部成员")
+        if incremental:
+            logger.info(f"群 {group_id} 增量扫描: {len(group_members)} 名成员中需要检查 {len(to_check)} 名")
+
+        scan_start = time.perf_counter()
+        blacklisted_members = []
+        verified_user_ids = []
+        checked_count = 0
+        failed_count = 0
+        aborted = False
+        total_count = len(to_check)
+        yield checked_count, total_count, blacklisted_members, failed_count
+
+        checks = self._iter_check_users(to_check, api_key, group_id=group_id)
+        try:
+            async for user_id, verdict in checks:
+                checked_count += 1
+                if verdict is None:
+                    failed_count += 1
+                    aborted = self._circuit_open()
+                else:
+                    if not verdict.blacklisted:
+                        verified_user_ids.append(user_id)
+                    self._collect_blacklisted(verdict, blacklisted_members)
+                yield checked_count, total_count, blacklisted_members, failed_count
+                if aborted:
+                    break
+        finally:
+            # 提前结束时取消剩余的在途查询
+            await checks.aclose()
+
+        scan_duration = time.perf_counter() - scan_start
+        self.metrics.observe("scan_duration_seconds", scan_duration)
+        self.metrics.set("scan_last_duration_seconds", round(scan_duration, 3), group=group_id)
+        self.metrics.inc("scan_members_total", checked_count)
+        logger.info(
+            f"群 {group_id} 扫描{'中止' if aborted else '完成'}，耗时 {scan_duration:.1f} 秒，"
+            f"共发现 {len(blacklisted_members)} 名云黑成员，{failed_count} 名查询失败"
+        )
+
+        if snapshot is not None:
+            try:
+                await loop.run_in_executor(None, snapshot.mark_verified, group_id, verified_user_ids)
+                if not aborted:
+                    await loop.run_in_executor(None, snapshot.set_last_scan, group_id)
+            except Exception as e:
+                logger.error(f"更新群 {group_id} 成员快照失败: {str(e)}")
+
+        if aborted:
+            raise CircuitOpenError(f"云黑API不可用，群 {group_id} 的扫描已中止")
+
+    @filter.command("大扫除", "扫描所有群云黑成员，大扫除!发送「大扫除 增量」只检查新成员和较久未检查的成员")
+    async def scan_group_members(self, event: AstrMessageEvent, mode: str = ""):
         # 检查是否在群聊中使用该命令
         if not event.get_group_id():
             yield event.plain_result("该命令只能在群聊中使用")
@@ -312,16 +907,14 @@ class QimengYunheiPlugin(Star):
             yield event.plain_result("请先在插件配置中填写申请的API Key")
             return
 
-        yield event.plain_result("收到~正在大扫除，请稍候...")
+        incremental = mode.strip() in ("增量", "incremental")
+        yield event.plain_result("收到~正在增量大扫除，请稍候..." if incremental else "收到~正在大扫除，请稍候...")
         
         try:
             # 获取群成员列表
             client = event.bot
             group_id = event.get_group_id()
-            members_data = await client.get_group_member_list(group_id=int(group_id))
-            # 提取成员QQ号列表，并过滤掉无效的用户ID（如0或负数或位数少于5位）
-            group_members = [str(member['user_id']) for member in members_data 
-                           if member['user_id'] > 0 and len(str(member['user_id'])) >= 5]
+            group_members = await self._fetch_group_members(client, group_id)
         except Exception as e:
             logger.error(f"获取群成员列表时出错: {str(e)}")
             yield event.plain_result("获取群成员列表失败")
@@ -331,54 +924,89 @@ class QimengYunheiPlugin(Star):
             yield event.plain_result("无法获取群成员列表")
             return
             
-        # 批量检查所有群成员
-        blacklisted_members = await self._batch_check_users(group_members, api_key)
+        # 检查是否安装了图片生成扩展，没有时使用文本结果，扫描过程中即可分页发送已发现的云黑成员
+        image_extension = None
+        try:
+            image_extension = await self._load_image_extension()
+        except Exception as e:
+            logger.error(f"加载图片生成扩展时出错: {e}，使用文本结果")
+        page_size = max(1, self.config.get("report_page_size", 10))
+        stream_findings = image_extension is None and self.config.get("report_stream_findings", True)
+        reported_count = 0
+
+        # 流式检查群成员，定期汇报进度
+        progress_interval = self.config.get("scan_progress_interval", 500)
+        aborted = False
+        try:
+            async for checked_count, total_count, blacklisted_members, failed_count in self._iter_scan_group(
+                group_id, group_members, api_key, incremental
+            ):
+                if progress_interval > 0 and checked_count and checked_count % progress_interval == 0 and checked_count < total_count:
+                    yield event.plain_result(
+                        f"扫描进度: {checked_count}/{total_count} 已检查，发现 {len(blacklisted_members)} 名云黑成员"
+                    )
+                # 每凑满一页就先发送出去
+                if stream_findings and len(blacklisted_members) - reported_count >= page_size:
+                    ready_count = (len(blacklisted_members) - reported_count) // page_size * page_size
+                    pages = render_pages(
+                        blacklisted_members[reported_count:reported_count + ready_count], page_size, start=reported_count
+                    )
+                    reported_count += ready_count
+                    for result in self._report_results(event, pages):
+                        yield result
+        except CircuitOpenError:
+            aborted = True
+
+        # API不可用时中止，不能把未检查的群报告为没有云黑成员
+        if aborted:
+            pages = render_pages(blacklisted_members[reported_count:], page_size, start=reported_count)
+            for result in self._report_results(event, pages):
+                yield result
+            result = (
+                f"云黑API当前不可用，扫描已中止！\n"
+                f"已检查 {checked_count}/{total_count} 名成员，其中 {failed_count} 名查询失败，"
+                f"发现 {len(blacklisted_members)} 名云黑成员。请稍后重新扫描。"
+            )
+            if blacklisted_members:
+                ttl = self.pending_kicks.put(group_id, blacklisted_members)
+                result += f"\n如需踢出已发现的云黑成员，请在{self._format_ttl(ttl)}内发送命令：确认踢出"
+            yield event.plain_result(result)
+            return
+
+        if incremental:
+            if not total_count:
+                yield event.plain_result("增量扫描完成：所有成员近期均已检查且结果正常，本次没有需要检查的成员。")
+                return
+            yield event.plain_result(f"增量扫描: 本次检查了 {total_count}/{len(group_members)} 名成员")
         
+        # 保存待踢出成员列表（图片结果和文本结果都需要）
+        if blacklisted_members:
+            ttl = self.pending_kicks.put(group_id, blacklisted_members)
+
         # 尝试使用图片生成插件
         try:
-            # 尝试导入并使用图片插件提供的全局函数
-            import importlib.util
-            import sys
-            import os
-            
-            # 构建插件路径
-            plugin_path = os.path.join(os.path.dirname(__file__), '..', 'asbot_plugin_furry-API-hykz', 'main.py')
-            plugin_path = os.path.abspath(plugin_path)
-            
-            if os.path.exists(plugin_path):
-                # 动态导入模块
-                spec = importlib.util.spec_from_file_location("asbot_plugin_furry_API_hykz.main", plugin_path)
-                module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(module)
-                
+            if image_extension is not None:
                 # 调用图片生成函数
-                img_base64 = await module.create_scan_result_image(
+                render = image_extension.create_scan_result_image
+                render_args = (
                     self.context,
                     len(group_members),
                     len(blacklisted_members),
-                    blacklisted_members,
+                    [member.to_member() for member in blacklisted_members],
                     str(group_id)
                 )
+                if inspect.iscoroutinefunction(render):
+                    img_data = await render(*render_args)
+                else:
+                    # 同步实现的图片生成放到线程池中执行，避免阻塞事件循环
+                    img_data = await asyncio.get_running_loop().run_in_executor(None, render, *render_args)
                 
-                # 保存图片到临时文件并发送
-                import base64
-                import tempfile
-                
-                # 创建临时文件
-                with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp_file:
-                    # 将base64数据解码并写入文件
-                    image_data = base64.b64decode(img_base64)
-                    tmp_file.write(image_data)
-                    tmp_file_path = tmp_file.name
-                
-                # 发送图片
-                yield event.image_result(tmp_file_path)
-                # 清理临时文件
-                import os
-                try:
-                    os.unlink(tmp_file_path)
-                except:
-                    pass
+                # 直接从内存发送图片，不经过临时文件
+                if isinstance(img_data, (bytes, bytearray)):
+                    image = message_components.Image.fromBytes(bytes(img_data))
+                else:
+                    image = message_components.Image.fromBase64(img_data)
+                yield event.chain_result([image])
                 return
             else:
                 logger.info("未检测到图片生成插件，使用文本结果")
@@ -386,24 +1014,143 @@ class QimengYunheiPlugin(Star):
             logger.error(f"生成图片时出错: {e}，使用文本结果")
         
         # 原始文本结果逻辑
+        failed_note = f"\n有 {failed_count} 名成员查询失败未能确认，建议稍后重新扫描。" if failed_count else ""
         if not blacklisted_members:
-            yield event.plain_result("扫描完成！未发现云黑成员。")
+            yield event.plain_result(
+                f"扫描完成！已确认的成员中未发现云黑成员。{failed_note}" if failed_count else "扫描完成！未发现云黑成员。"
+            )
             return
             
-        # 保存待踢出成员列表
-        self.pending_kick_members[group_id] = blacklisted_members
-        
-        # 构建云黑成员列表信息
-        result = f"扫描完成！发现 {len(blacklisted_members)} 名云黑成员：\n\n"
-        for i, member in enumerate(blacklisted_members, 1):
-            result += f"{i}. 用户ID: {member['id']}\n"
-            result += f"   原因: {member['reason']}\n"
-            result += f"   类型: {member['type']}\n"
-            result += f"   管理员: {member['admin']}\n"
-            result += f"   等级: {member['level']}\n"
-            result += f"   日期: {member['date']}\n\n"
+        # 分页发送尚未发送的云黑成员，最后发送汇总
+        pages = render_pages(blacklisted_members[reported_count:], page_size, start=reported_count)
+        for result in self._report_results(event, pages):
+            yield result
             
-        result += "如需踢出以上云黑成员，请在30秒内发送命令：确认踢出"
+        result = (
+            f"扫描完成！发现 {len(blacklisted_members)} 名云黑成员，详情见以上消息。{failed_note}\n"
+            f"如需踢出以上云黑成员，请在{self._format_ttl(ttl)}内发送命令：确认踢出"
+        )
+        yield event.plain_result(result)
+
+    def _report_results(self, event, pages):
+        """
+        将分页的扫描结果转换为要发送的消息
+        aiocqhttp平台默认使用合并转发，其他平台每页发送一条消息
+        """
+        use_forward = False
+        if self.config.get("report_forward", True):
+            try:
+                use_forward = event.get_platform_name() == "aiocqhttp"
+            except Exception:
+                use_forward = False
+        if use_forward:
+            for chain in build_forward_messages(pages, event.get_self_id()):
+                yield event.chain_result(chain)
+        else:
+            for page in pages:
+                yield event.plain_result(page)
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("全局大扫除", "扫描所有已配置群的云黑成员，重复的成员只查询一次")
+    async def sweep_all_groups(self, event: AstrMessageEvent):
+        # 检查API Key是否配置
+        api_key = self.config.get("api_key", "")
+        if not api_key:
+            yield event.plain_result("请先在插件配置中填写申请的API Key")
+            return
+
+        group_ids = self._get_sweep_groups()
+        if not group_ids:
+            yield event.plain_result("未配置任何群（enabled_groups / auto_check_whitelist），无法进行全局大扫除")
+            return
+
+        yield event.plain_result(f"收到~正在对 {len(group_ids)} 个群进行全局大扫除，请稍候...")
+
+        # 并发获取所有群的成员列表
+        client = event.bot
+        results = await asyncio.gather(
+            *[self._fetch_group_members(client, group_id) for group_id in group_ids],
+            return_exceptions=True
+        )
+
+        # 建立 用户 -> 所在群 的映射，每个用户只查询一次
+        user_groups = {}
+        failed_groups = []
+        member_counts = {}
+        for group_id, members in zip(group_ids, results):
+            if isinstance(members, Exception):
+                logger.error(f"获取群 {group_id} 成员列表时出错: {str(members)}")
+                failed_groups.append(group_id)
+                continue
+            member_counts[group_id] = len(members)
+            for user_id in members:
+                user_groups.setdefault(user_id, []).append(group_id)
+
+        if not user_groups:
+            yield event.plain_result("无法获取任何群的成员列表")
+            return
+
+        total_memberships = sum(member_counts.values())
+        logger.info(f"全局大扫除: {len(member_counts)} 个群共 {total_memberships} 个成员，去重后 {len(user_groups)} 个用户")
+
+        # 流式检查去重后的用户，并将云黑成员分发回各自所在的群
+        group_hits = {group_id: [] for group_id in member_counts}
+        hit_count = 0
+        checked_count = 0
+        failed_count = 0
+        aborted = False
+        total_count = len(user_groups)
+        progress_interval = self.config.get("scan_progress_interval", 500)
+        checks = self._iter_check_users(list(user_groups), api_key, group_id="global")
+        try:
+            async for user_id, verdict in checks:
+                checked_count += 1
+                if verdict is None:
+                    failed_count += 1
+                    # API熔断后剩余查询都会直接失败，中止扫描
+                    if self._circuit_open():
+                        aborted = True
+                        break
+                elif verdict.blacklisted:
+                    logger.info(f"发现云黑成员: {user_id}, 原因: {verdict.reason}")
+                    hit_count += 1
+                    for group_id in user_groups[user_id]:
+                        group_hits[group_id].append(verdict)
+                if progress_interval > 0 and checked_count % progress_interval == 0 and checked_count < total_count:
+                    yield event.plain_result(
+                        f"全局扫描进度: {checked_count}/{total_count} 已检查，发现 {hit_count} 名云黑成员"
+                    )
+        finally:
+            await checks.aclose()
+
+        # 保存各群的待踢出成员列表
+        ttl = self._sweep_pending_ttl()
+        for group_id, members in group_hits.items():
+            if members:
+                self.pending_kicks.put(group_id, members, ttl=ttl)
+
+        if aborted:
+            result = (
+                f"云黑API当前不可用，全局大扫除已中止！\n"
+                f"已检查 {checked_count}/{total_count} 人，其中 {failed_count} 人查询失败，请稍后重新扫描\n"
+                f"发现 {hit_count} 名云黑成员\n"
+            )
+        else:
+            result = (
+                f"全局大扫除完成！\n"
+                f"共扫描 {len(member_counts)} 个群，{total_memberships} 人次，去重后实际查询 {total_count} 人\n"
+                f"发现 {hit_count} 名云黑成员\n"
+            )
+            if failed_count:
+                result += f"有 {failed_count} 人查询失败未能确认，建议稍后重新扫描\n"
+        for group_id, members in group_hits.items():
+            if members:
+                result += f"\n群 {group_id}: {len(members)} 名云黑成员（" + "、".join(m.id for m in members[:10])
+                result += "等）" if len(members) > 10 else "）"
+        if failed_groups:
+            result += f"\n\n获取成员列表失败的群: {'、'.join(failed_groups)}"
+        if hit_count:
+            result += f"\n\n如需踢出云黑成员，请在{self._format_ttl(ttl)}内于对应群发送命令：确认踢出"
         yield event.plain_result(result)
 
     @filter.command("确认踢出", "确认踢出云黑成员")
@@ -415,28 +1162,199 @@ class QimengYunheiPlugin(Star):
             
         group_id = event.get_group_id()
         
-        # 检查是否有待踢出的成员
-        if group_id not in self.pending_kick_members or not self.pending_kick_members[group_id]:
-            yield event.plain_result("当前没有待踢出的云黑成员。请先执行「扫描群成员」命令。")
+        # 取出待踢出的成员，同时防止重复确认；超过有效期的列表不再执行
+        blacklisted_members = self.pending_kicks.pop(group_id)
+        if not blacklisted_members:
+            yield event.plain_result("当前没有待踢出的云黑成员或确认已超时。请先执行「大扫除」命令。")
             return
             
-        blacklisted_members = self.pending_kick_members[group_id]
+        total_count = len(blacklisted_members)
         kicked_count = 0
+        done_count = 0
+        progress_interval = self.config.get("kick_progress_interval", 20)
         
-        # 踢出所有云黑成员
-        for member in blacklisted_members:
-            member_id = member['id']
-            try:
-                # 使用set_group_kick接口踢出成员
-                await self.context.bot.set_group_kick(group_id=group_id, user_id=member_id, reject_add_request=False)
+        if total_count > progress_interval > 0:
+            yield event.plain_result(f"开始踢出 {total_count} 名云黑成员，请稍候...")
+        
+        # 并发踢出所有云黑成员
+        async for member_id, error in self.kick_executor.iter_kick(
+            event.bot, group_id, [member.id for member in blacklisted_members],
+            reject_add_request=self.group_policies.policy(group_id).reject_add_request
+        ):
+            done_count += 1
+            if error is None:
                 kicked_count += 1
+                self.metrics.inc("kicks_total", source="confirm", result="success")
                 logger.info(f"已踢出云黑成员: {member_id}")
-            except Exception as e:
-                logger.error(f"踢出成员 {member_id} 时出错: {str(e)}")
-                continue
-                
-        # 清除已处理的待踢出成员列表
-        del self.pending_kick_members[group_id]
+            else:
+                self.metrics.inc("kicks_total", source="confirm", result="failure")
+                logger.error(f"踢出成员 {member_id} 时出错: {str(error)}")
+            if progress_interval > 0 and done_count % progress_interval == 0 and done_count < total_count:
+                yield event.plain_result(f"踢出进度: {done_count}/{total_count}，成功 {kicked_count} 名")
         
-        result = f"已完成踢出操作！\n成功踢出云黑成员数：{kicked_count}\n失败数：{len(blacklisted_members) - kicked_count}"
-        yield event.plain_result(result)
\ No newline at end of file
+        result = f"已完成踢出操作！\n成功踢出云黑成员数：{kicked_count}\n失败数：{total_count - kicked_count}"
+        yield event.plain_result(result)
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("云黑队列", "查看API请求调度队列状态")
+    async def show_rate_queue(self, event: AstrMessageEvent):
+        snapshot = self.rate_scheduler.snapshot()
+        result = (
+            f"API请求调度状态\n"
+            f"当前窗口已用额度: {snapshot['in_window']}/{snapshot['max_requests']}（{snapshot['time_window']}秒）\n"
+        )
+        if snapshot['shared_in_window'] is not None:
+            result += f"所有进程合计已用额度: {snapshot['shared_in_window']}/{snapshot['max_requests']}\n"
+        if not snapshot['priorities']:
+            result += "暂无请求记录"
+        for stats in snapshot['priorities'].values():
+            result += (
+                f"\n[{stats['name']}]\n"
+                f"   排队中: {stats['queued']}\n"
+                f"   已发出: {stats['granted']}\n"
+                f"   平均等待: {stats['avg_wait']:.2f} 秒（最近: {stats['recent_avg_wait']:.2f} 秒）\n"
+                f"   最长等待: {stats['max_wait']:.2f} 秒\n"
+            )
+        yield event.plain_result(result.rstrip())
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("云黑统计", "查看插件运行指标")
+    async def show_metrics(self, event: AstrMessageEvent):
+        metrics = self.metrics
+        uptime = time.time() - metrics.started_at
+        result = f"云黑插件运行统计（已运行 {uptime / 3600:.1f} 小时）\n"
+
+        api = metrics.histogram("api_request_seconds")
+        requests = metrics.counter("api_requests_total")
+        errors = metrics.counter("api_errors_total")
+        result += f"\n[API请求]\n   实际发出: {requests} 次（含重试），查询失败: {errors} 次"
+        if api:
+            result += f"\n   耗时 p50/p99: {api.quantile(0.5):.3f}/{api.quantile(0.99):.3f} 秒，最长 {api.max:.3f} 秒"
+        result += (
+            f"\n   重试: {metrics.counter('api_retries_total')}，限流(429): {metrics.counter('api_throttled_total')}，"
+            f"熔断拒绝: {metrics.counter('circuit_rejected_total')}"
+        )
+        breaker = self.http_client.breaker
+        if breaker.state != breaker.CLOSED:
+            result += f"\n   熔断器: {breaker.state}（{breaker.remaining_open_time():.0f} 秒后探测）"
+        result += f"\n   JSON修复: {metrics.counter('json_repaired_total')}，解析失败: {metrics.counter('json_errors_total')}"
+
+        result += "\n\n[频率限制排队]"
+        for name in PRIORITY_NAMES.values():
+            wait = metrics.histogram("rate_limit_wait_seconds", priority=name)
+            if wait:
+                result += f"\n   {name}: 平均 {wait.mean:.2f} 秒，p99 {wait.quantile(0.99):.2f} 秒（{wait.count} 次）"
+        queued = sum(self.rate_scheduler.queue_depth().values())
+        result += f"\n   当前排队: {queued}"
+
+        if self.verdict_cache is not None:
+            hits = metrics.counter("cache_hits_total")
+            misses = metrics.counter("cache_misses_total")
+            total = hits + misses
+            result += f"\n\n[缓存]\n   命中: {hits}，未命中: {misses}"
+            if total:
+                result += f"，命中率 {hits / total:.1%}"
+            result += f"\n   合并的并发查询: {metrics.counter('lookup_shared_total')}"
+
+        scan = metrics.histogram("scan_duration_seconds")
+        if scan:
+            result += f"\n\n[大扫除]\n   次数: {scan.count}，共检查 {metrics.counter('scan_members_total')} 人，平均耗时 {scan.mean:.1f} 秒"
+            for group, duration in sorted(metrics.gauges("scan_last_duration_seconds").items()):
+                result += f"\n   群 {group} 最近一次: {duration:.1f} 秒"
+
+        if self.blacklist_mirror is not None:
+            result += (
+                f"\n\n[本地云黑库]\n   记录数: {len(self.blacklist_mirror)}，命中: {metrics.counter('mirror_hits_total')}"
+            )
+            if self._api_degraded:
+                result += "\n   当前处于离线模式（API不可用）"
+
+        kicks_ok = metrics.counter("kicks_total", source="join", result="success") + \
+            metrics.counter("kicks_total", source="confirm", result="success")
+        kicks_total = metrics.counter("kicks_total")
+        if kicks_total:
+            result += (
+                f"\n\n[踢出成员]\n   成功: {kicks_ok}/{kicks_total}（{kicks_ok / kicks_total:.1%}）"
+                f"，重试: {metrics.counter('kick_retries_total')}"
+            )
+
+        yield event.plain_result(result)
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("导入云黑库", "从文件导入云黑ID到本地云黑库，每行一个QQ号")
+    async def import_blacklist_mirror(self, event: AstrMessageEvent, path: str = ""):
+        if self.blacklist_mirror is None:
+            yield event.plain_result("本地云黑库未启用")
+            return
+        if not path:
+            yield event.plain_result("请指定要导入的文件路径，例如：导入云黑库 /path/to/blacklist.txt")
+            return
+        try:
+            ids = await asyncio.get_running_loop().run_in_executor(None, BlacklistMirror.read_dump, path)
+            before = len(self.blacklist_mirror)
+            await self._merge_blacklist_mirror(ids)
+            added = len(self.blacklist_mirror) - before
+        except Exception as e:
+            logger.error(f"导入本地云黑库失败: {str(e)}")
+            yield event.plain_result(f"导入失败: {str(e)}")
+            return
+        yield event.plain_result(f"导入完成！新增 {added} 条记录，本地云黑库共 {len(self.blacklist_mirror)} 条记录")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("导出云黑库", "导出本地云黑库中的所有云黑ID")
+    async def export_blacklist_mirror(self, event: AstrMessageEvent, path: str = ""):
+        if self.blacklist_mirror is None:
+            yield event.plain_result("本地云黑库未启用")
+            return
+        if not path:
+            path = os.path.join(_get_data_dir(), "blacklist_dump.txt")
+        try:
+            async with self._mirror_lock:
+                added, removed = self.blacklist_mirror.pending_changes()
+                count = await asyncio.get_running_loop().run_in_executor(
+                    None, self.blacklist_mirror.export_dump, path, added, removed
+                )
+        except Exception as e:
+            logger.error(f"导出本地云黑库失败: {str(e)}")
+            yield event.plain_result(f"导出失败: {str(e)}")
+            return
+        yield event.plain_result(f"导出完成！共 {count} 条记录，已保存到 {path}")
+
+    async def terminate(self):
+        """
+        插件卸载时释放资源
+        """
+        for task in list(self._background_tasks) + list(self._join_batch_tasks):
+            task.cancel()
+        # 还在合并窗口中等待的进群检测直接结束
+        for _, futures in self._join_batch.values():
+            for future in futures:
+                if not future.done():
+                    future.cancel()
+        self._join_batch.clear()
+        try:
+            await self.http_client.aclose()
+        except Exception as e:
+            logger.error(f"关闭HTTP客户端时出错: {str(e)}")
+        await self.rate_scheduler.close()
+        if self.shared_rate_window is not None:
+            self.shared_rate_window.close()
+        await self.kick_executor.close()
+        if self.verdict_cache is not None:
+            if self._cache_flush_task is not None:
+                self._cache_flush_task.cancel()
+            # 插件卸载前写入还未提交的查询结果
+            if self._cache_writes:
+                try:
+                    self.verdict_cache.set_many(
+                        [(user_id, verdict.to_info(), verdict.blacklisted) for user_id, verdict in self._cache_writes.items()]
+                    )
+                except Exception as e:
+                    logger.error(f"写入云黑缓存失败: {str(e)}")
+                self._cache_writes.clear()
+            self.verdict_cache.close()
+        if self.member_snapshot is not None:
+            self.member_snapshot.close()
+        self.pending_kicks.close()
+        if self.blacklist_mirror is not None:
+            self.blacklist_mirror.close()
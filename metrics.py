@@ -0,0 +1,174 @@
+import math
+import os
+import time
+
+# 请求延迟、排队等待等短耗时的分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 扫描耗时等长耗时的分桶（秒）
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _format_labels(key):
+    if not key:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in key)
+    return "{" + pairs + "}"
+
+
+class Histogram:
+    """
+    固定分桶的直方图，分位数按桶内线性插值估算
+    """
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, bucket_count in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.max
+            if bucket_count and seen + bucket_count >= rank:
+                # 估算值不超过实际观测到的最大值
+                return min(self.max, lower + (upper - lower) * (rank - seen) / bucket_count)
+            seen += bucket_count
+            lower = upper
+        return self.max
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+
+class PluginMetrics:
+    """
+    插件运行指标：计数器、仪表和直方图，均保存在进程内存中
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._histogram_buckets = {}
+        self._help = {}
+
+    def describe(self, name, help_text, buckets=None):
+        self._help[name] = help_text
+        if buckets is not None:
+            self._histogram_buckets[name] = buckets
+
+    def inc(self, name, value=1, **labels):
+        series = self._counters.setdefault(name, {})
+        key = _label_key(labels)
+        series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        series = self._histograms.setdefault(name, {})
+        key = _label_key(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram(self._histogram_buckets.get(name, LATENCY_BUCKETS))
+        histogram.observe(value)
+
+    def counter(self, name, **labels):
+        series = self._counters.get(name, {})
+        if labels:
+            return series.get(_label_key(labels), 0)
+        return sum(series.values())
+
+    def gauges(self, name):
+        return {dict(key).get("group", ""): value for key, value in self._gauges.get(name, {}).items()}
+
+    def histogram(self, name, **labels):
+        """
+        获取直方图，不指定标签时合并所有标签
+        """
+        series = self._histograms.get(name, {})
+        if labels:
+            return series.get(_label_key(labels))
+        if not series:
+            return None
+        merged = Histogram(self._histogram_buckets.get(name, LATENCY_BUCKETS))
+        for histogram in series.values():
+            merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+            merged.count += histogram.count
+            merged.sum += histogram.sum
+            merged.max = max(merged.max, histogram.max)
+        return merged
+
+    def render_prometheus(self, prefix="qimeng_yunhei_"):
+        """
+        以Prometheus文本格式输出所有指标
+        """
+        lines = []
+        for name, series in sorted(self._counters.items()):
+            full_name = prefix + name
+            if name in self._help:
+                lines.append(f"# HELP {full_name} {self._help[name]}")
+            lines.append(f"# TYPE {full_name} counter")
+            for key, value in series.items():
+                lines.append(f"{full_name}{_format_labels(key)} {value}")
+        for name, series in sorted(self._gauges.items()):
+            full_name = prefix + name
+            if name in self._help:
+                lines.append(f"# HELP {full_name} {self._help[name]}")
+            lines.append(f"# TYPE {full_name} gauge")
+            for key, value in series.items():
+                lines.append(f"{full_name}{_format_labels(key)} {value}")
+        for name, series in sorted(self._histograms.items()):
+            full_name = prefix + name
+            if name in self._help:
+                lines.append(f"# HELP {full_name} {self._help[name]}")
+            lines.append(f"# TYPE {full_name} histogram")
+            for key, histogram in series.items():
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets + (math.inf,), histogram.counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == math.inf else repr(float(bound))
+                    lines.append(f"{full_name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+                lines.append(f"{full_name}_sum{_format_labels(key)} {histogram.sum}")
+                lines.append(f"{full_name}_count{_format_labels(key)} {histogram.count}")
+        lines.append(f"# TYPE {prefix}start_time_seconds gauge")
+        lines.append(f"{prefix}start_time_seconds {self.started_at}")
+        return "\n".join(lines) + "\n"
+
+
+def write_text_atomic(path, text):
+    """
+    原子地写入文本文件（如Prometheus指标，供node_exporter textfile collector等读取），
+    先写入临时文件再替换，读取方不会读到写了一半的文件
+    指标对象不是线程安全的，在线程池中写文件时应先在事件循环中渲染好文本
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,246 @@
+import mmap
+import os
+import re
+import tempfile
+from array import array
+from bisect import bisect_left
+
+from astrbot.api import logger
+
+# 从导入文件中提取QQ号
+_ID_PATTERN = re.compile(r'\d{5,}')
+
+
+class BlacklistMirror:
+    """
+    本地云黑库镜像
+    已知云黑ID以有序int64数组保存，通过二分查找判断，数据量较大时直接内存映射索引文件；
+    新发现的云黑ID和被API确认已移出云黑的ID先追加到日志文件，积累到一定数量后再合并进索引。
+    合并分为三步：pending_changes 取出待合并的变更，build_index 生成新索引文件（可在线程池中执行），
+    install_index 替换索引；后两步之间新增的变更会保留到下一次合并
+    """
+
+    def __init__(self, index_path, merge_threshold=1000, mmap_threshold=1000000):
+        self.index_path = index_path
+        self.journal_path = f"{index_path}.log"
+        self.merge_threshold = merge_threshold
+        self.mmap_threshold = mmap_threshold
+        self._index = array('q')
+        self._mmap = None
+        self._added = set()
+        # 已从云黑中移除、但仍在索引文件中的ID
+        self._removed = set()
+
+        index_dir = os.path.dirname(index_path)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+        self._load_index()
+        self._load_journal()
+
+    def _load_index(self):
+        self._close_mmap()
+        try:
+            size = os.path.getsize(self.index_path)
+        except OSError:
+            self._index = array('q')
+            return
+        itemsize = array('q').itemsize
+        if size // itemsize >= self.mmap_threshold:
+            # 数据量大时直接映射文件，不读入内存
+            with open(self.index_path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._index = memoryview(self._mmap)[:size - size % itemsize].cast('q')
+        else:
+            index = array('q')
+            with open(self.index_path, 'rb') as f:
+                index.frombytes(f.read(size - size % itemsize))
+            self._index = index
+
+    def _load_journal(self):
+        # 日志每行一个ID，以-开头表示移除
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line.isdigit():
+                        user_id = int(line)
+                        self._added.add(user_id)
+                        self._removed.discard(user_id)
+                    elif line.startswith('-') and line[1:].isdigit():
+                        user_id = int(line[1:])
+                        self._removed.add(user_id)
+                        self._added.discard(user_id)
+        except OSError:
+            return
+        # 日志里已经在索引中的新增ID、不在索引中的移除ID都不需要再保留
+        self._added = {user_id for user_id in self._added if not self._in_index(user_id)}
+        self._removed = {user_id for user_id in self._removed if self._in_index(user_id)}
+
+    def _append_journal(self, line):
+        try:
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(f"{line}\n")
+        except OSError as e:
+            logger.error(f"写入本地云黑库日志失败: {str(e)}")
+
+    def _rewrite_journal(self):
+        lines = [f"{user_id}\n" for user_id in self._added] + [f"-{user_id}\n" for user_id in self._removed]
+        if not lines:
+            try:
+                os.remove(self.journal_path)
+            except OSError:
+                pass
+            return
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        os.replace(tmp_path, self.journal_path)
+
+    def _close_mmap(self):
+        if self._mmap is not None:
+            if isinstance(self._index, memoryview):
+                self._index.release()
+            self._index = array('q')
+            self._mmap.close()
+            self._mmap = None
+
+    def _in_index(self, user_id):
+        index = self._index
+        i = bisect_left(index, user_id)
+        return i < len(index) and index[i] == user_id
+
+    def __contains__(self, user_id):
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return False
+        if user_id in self._added:
+            return True
+        return user_id not in self._removed and self._in_index(user_id)
+
+    def __len__(self):
+        return len(self._index) - len(self._removed) + len(self._added)
+
+    def add(self, user_id):
+        """
+        记录一个云黑ID，已存在时忽略
+        """
+        user_id = int(user_id)
+        if user_id in self:
+            return False
+        if user_id in self._removed:
+            self._removed.discard(user_id)
+        else:
+            self._added.add(user_id)
+        self._append_journal(user_id)
+        return True
+
+    def discard(self, user_id):
+        """
+        移除一个云黑ID（如API确认该用户已不在云黑中），不存在时忽略
+        """
+        user_id = int(user_id)
+        if user_id not in self:
+            return False
+        if user_id in self._added:
+            self._added.discard(user_id)
+        else:
+            self._removed.add(user_id)
+        self._append_journal(f"-{user_id}")
+        return True
+
+    def needs_merge(self):
+        return len(self._added) + len(self._removed) >= self.merge_threshold
+
+    def pending_changes(self):
+        """
+        取出当前待合并的变更快照 (新增ID, 移除ID)
+        """
+        return frozenset(self._added), frozenset(self._removed)
+
+    def build_index(self, added, removed, extra_ids=()):
+        """
+        生成合并后的索引临时文件并返回其路径，只读取当前索引，可以在线程池中执行
+        """
+        merged = set(self._index)
+        merged.difference_update(removed)
+        merged.update(added)
+        merged.update(extra_ids)
+        index = array('q', sorted(merged))
+
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=os.path.basename(self.index_path) + '.', suffix='.tmp', dir=os.path.dirname(self.index_path) or None
+        )
+        with os.fdopen(fd, 'wb') as f:
+            index.tofile(f)
+        return tmp_path
+
+    def install_index(self, tmp_path, added, removed):
+        """
+        用build_index生成的文件替换索引，并从日志中去掉已合并的变更
+        """
+        # 生成新索引期间可能又有新增或移除，先按替换前的状态记下这些ID应有的结果
+        touched = added | removed | self._added | self._removed
+        expected = {user_id: user_id in self for user_id in touched}
+        self._close_mmap()
+        os.replace(tmp_path, self.index_path)
+        self._load_index()
+        self._added = set()
+        self._removed = set()
+        for user_id, present in expected.items():
+            in_index = self._in_index(user_id)
+            if present and not in_index:
+                self._added.add(user_id)
+            elif in_index and not present:
+                self._removed.add(user_id)
+        self._rewrite_journal()
+
+    def merge(self, extra_ids=()):
+        """
+        将日志中的变更合并进有序索引并重写索引文件，返回记录数
+        """
+        added, removed = self.pending_changes()
+        self.install_index(self.build_index(added, removed, extra_ids), added, removed)
+        return len(self)
+
+    @staticmethod
+    def read_dump(path):
+        """
+        读取导出文件中的云黑ID（每行一个，也可以用逗号或空格分隔，#开头的行会被忽略）
+        """
+        ids = set()
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.lstrip().startswith('#'):
+                    continue
+                ids.update(int(match) for match in _ID_PATTERN.findall(line))
+        return ids
+
+    def import_dump(self, path):
+        """
+        从导出文件导入云黑ID，返回新增的数量
+        """
+        before = len(self)
+        self.merge(self.read_dump(path))
+        return len(self) - before
+
+    def export_dump(self, path, added=None, removed=None):
+        """
+        导出所有云黑ID到文件，每行一个，返回导出的数量
+        在线程池中执行时应传入pending_changes取得的快照
+        """
+        added = self._added if added is None else added
+        removed = self._removed if removed is None else removed
+        ids = sorted((set(self._index) - removed) | added)
+        with open(path, 'w', encoding='utf-8') as f:
+            for user_id in ids:
+                f.write(f"{user_id}\n")
+        return len(ids)
+
+    def close(self):
+        if self._added or self._removed:
+            try:
+                self.merge()
+            except Exception as e:
+                logger.error(f"合并本地云黑库失败: {str(e)}")
+        self._close_mmap()
@@ -0,0 +1,142 @@
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+from astrbot.api import logger
+
+from .decoder import YunheiVerdict
+
+
+class PendingKickStore:
+    """
+    待确认踢出的云黑成员列表
+    每个群一条记录，超过有效期后不能再确认；记录数超过上限时淘汰最早保存的群。
+    可选地保存到SQLite，插件重启后未过期的扫描结果依然可以确认踢出；
+    过期记录由后台任务定期清理
+    """
+
+    def __init__(self, ttl=30, max_groups=200, db_path=None):
+        self.ttl = ttl
+        self.max_groups = max(1, max_groups)
+        # {group_id: (过期时间, [YunheiVerdict, ...])}，按保存顺序排列
+        self._entries = OrderedDict()
+        self._conn = None
+
+        if db_path:
+            db_dir = os.path.dirname(db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pending_kicks ("
+                "group_id TEXT PRIMARY KEY, "
+                "expires_at REAL NOT NULL, "
+                "members TEXT NOT NULL)"
+            )
+            self._conn.commit()
+            self._load()
+
+    def _load(self):
+        """
+        从数据库恢复未过期的记录
+        """
+        self._conn.execute("DELETE FROM pending_kicks WHERE expires_at <= ?", (time.time(),))
+        self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT group_id, expires_at, members FROM pending_kicks ORDER BY expires_at"
+        ).fetchall()
+        for group_id, expires_at, members in rows:
+            try:
+                verdicts = [YunheiVerdict.from_info(user_id, info) for user_id, info in json.loads(members)]
+            except (ValueError, TypeError, AttributeError) as e:
+                logger.warning(f"待踢出记录损坏，已忽略群 {group_id}: {str(e)}")
+                continue
+            self._entries[group_id] = (expires_at, verdicts)
+        if self._entries:
+            logger.info(f"已恢复 {len(self._entries)} 个群的待踢出成员列表")
+
+    def put(self, group_id, members, ttl=None):
+        """
+        保存群的待踢出成员列表，覆盖该群之前的记录，返回有效期（秒）
+        """
+        group_id = str(group_id)
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl
+        members = list(members)
+        self._entries.pop(group_id, None)
+        self._entries[group_id] = (expires_at, members)
+
+        evicted = []
+        while len(self._entries) > self.max_groups:
+            evicted.append(self._entries.popitem(last=False)[0])
+        if evicted:
+            logger.info(f"待踢出列表已满，淘汰最早保存的 {len(evicted)} 个群")
+
+        if self._conn is not None:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO pending_kicks (group_id, expires_at, members) VALUES (?, ?, ?)",
+                    (group_id, expires_at, json.dumps(
+                        [[member.id, member.to_info()] for member in members], ensure_ascii=False
+                    ))
+                )
+                self._conn.executemany(
+                    "DELETE FROM pending_kicks WHERE group_id = ?", [(evicted_id,) for evicted_id in evicted]
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"保存待踢出成员列表失败: {str(e)}")
+        return ttl
+
+    def pop(self, group_id):
+        """
+        取出并删除群的待踢出成员列表，没有记录或已过期时返回None
+        """
+        group_id = str(group_id)
+        entry = self._entries.pop(group_id, None)
+        if entry is None:
+            return None
+        self._delete(group_id)
+        expires_at, members = entry
+        if expires_at <= time.time():
+            return None
+        return members
+
+    def _delete(self, group_id):
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute("DELETE FROM pending_kicks WHERE group_id = ?", (group_id,))
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"删除待踢出成员列表失败: {str(e)}")
+
+    def purge_expired(self):
+        """
+        删除所有已过期的记录，返回删除的数量
+        """
+        now = time.time()
+        expired = [group_id for group_id, (expires_at, _) in self._entries.items() if expires_at <= now]
+        for group_id in expired:
+            del self._entries[group_id]
+        if self._conn is not None:
+            try:
+                self._conn.execute("DELETE FROM pending_kicks WHERE expires_at <= ?", (now,))
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"清理过期待踢出记录失败: {str(e)}")
+        return len(expired)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
@@ -0,0 +1,177 @@
+import json
+
+from astrbot.api import logger
+
+# 进群检测的通知级别
+NOTIFY_ALL = "all"              # 云黑成员和正常成员都发送通知
+NOTIFY_BLACKLIST = "blacklist"  # 只通知云黑成员（包括踢出失败）
+NOTIFY_NONE = "none"            # 不发送群通知，只记录日志
+NOTIFY_LEVELS = (NOTIFY_ALL, NOTIFY_BLACKLIST, NOTIFY_NONE)
+
+
+def _parse_group_id(value):
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        logger.warning(f"群列表配置中的群号无效: {value}")
+        return None
+
+
+def _parse_bool(value, default):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        lowered = value.strip().lower()
+        if lowered in ("true", "1", "yes", "on", "是", "开启"):
+            return True
+        if lowered in ("false", "0", "no", "off", "否", "关闭"):
+            return False
+        return default
+    if isinstance(value, (int, float)):
+        return bool(value)
+    return default
+
+
+def _parse_notify(value, default):
+    value = str(value).strip().lower() if value is not None else ""
+    if value in NOTIFY_LEVELS:
+        return value
+    if value:
+        logger.warning(f"无效的通知级别: {value}，可选值为 {', '.join(NOTIFY_LEVELS)}")
+    return default
+
+
+def _load_group_configs(raw):
+    """
+    解析group_configs配置，支持字典或JSON字符串，返回 {群号: 配置字典}
+    """
+    if not raw:
+        return {}
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError as e:
+            logger.error(f"group_configs 不是有效的JSON，已忽略: {str(e)}")
+            return {}
+    if not isinstance(raw, dict):
+        logger.error("group_configs 应为 {群号: 配置} 格式，已忽略")
+        return {}
+    configs = {}
+    for group_id, settings in raw.items():
+        group_id = _parse_group_id(group_id)
+        if group_id is None:
+            continue
+        if not isinstance(settings, dict):
+            logger.warning(f"群 {group_id} 的独立配置不是字典，已忽略")
+            continue
+        configs[group_id] = settings
+    return configs
+
+
+class GroupPolicy:
+    """
+    单个群的进群检测策略
+    """
+
+    __slots__ = ('group_id', 'auto_check', 'auto_kick', 'notify', 'reject_add_request')
+
+    def __init__(self, group_id, auto_check=True, auto_kick=True, notify=NOTIFY_ALL, reject_add_request=False):
+        self.group_id = group_id
+        self.auto_check = auto_check
+        self.auto_kick = auto_kick
+        self.notify = notify
+        self.reject_add_request = reject_add_request
+
+    def should_notify(self, blacklisted):
+        if self.notify == NOTIFY_ALL:
+            return True
+        return blacklisted and self.notify == NOTIFY_BLACKLIST
+
+
+class GroupPolicyIndex:
+    """
+    预先编译的群策略索引
+    启用群列表和进群检测白名单转换为不可变的整数集合，每个群的独立配置合并全局默认值后预先生成，
+    处理进群事件时只需一次字典查询
+    """
+
+    def __init__(self, config):
+        enabled_groups = self._parse_ids(config.get("enabled_groups", []))
+        auto_check_groups = self._parse_ids(config.get("auto_check_whitelist", []))
+        self.enabled_groups = frozenset(enabled_groups)
+        self.auto_check_groups = frozenset(auto_check_groups)
+        self.defaults = GroupPolicy(
+            None,
+            auto_kick=_parse_bool(config.get("join_auto_kick", True), True),
+            notify=_parse_notify(config.get("join_notify_level", NOTIFY_ALL), NOTIFY_ALL),
+            reject_add_request=_parse_bool(config.get("kick_reject_add_request", False), False)
+        )
+        self.group_settings = _load_group_configs(config.get("group_configs", {}))
+
+        # 只为会进行进群检测的群生成策略，其余群查不到即跳过
+        self._join_policies = {}
+        for group_id in self.auto_check_groups:
+            if self.enabled_groups and group_id not in self.enabled_groups:
+                continue
+            policy = self._build_policy(group_id)
+            if policy.auto_check:
+                self._join_policies[group_id] = policy
+
+        # 全局扫描的群列表：启用云黑检测的群与进群自动检测白名单的并集，保持配置中的顺序
+        self.sweep_groups = tuple(str(group_id) for group_id in dict.fromkeys(enabled_groups + auto_check_groups))
+
+    @staticmethod
+    def _parse_ids(values):
+        group_ids = []
+        for value in values or []:
+            group_id = _parse_group_id(value)
+            if group_id is not None:
+                group_ids.append(group_id)
+        return group_ids
+
+    def _build_policy(self, group_id):
+        settings = self.group_settings.get(group_id, {})
+        defaults = self.defaults
+        return GroupPolicy(
+            group_id,
+            auto_check=_parse_bool(settings.get("auto_check", True), True),
+            auto_kick=_parse_bool(settings.get("auto_kick", defaults.auto_kick), defaults.auto_kick),
+            notify=_parse_notify(settings.get("notify", defaults.notify), defaults.notify),
+            reject_add_request=_parse_bool(
+                settings.get("reject_add_request", defaults.reject_add_request), defaults.reject_add_request
+            )
+        )
+
+    def join_policy(self, group_id):
+        """
+        获取群的进群检测策略，未启用进群检测的群返回None
+        """
+        return self._join_policies.get(group_id)
+
+    def policy(self, group_id):
+        """
+        获取任意群的策略（用于大扫除后踢出等），未单独配置的群使用全局默认值
+        """
+        try:
+            group_id = int(group_id)
+        except (TypeError, ValueError):
+            return self.defaults
+        policy = self._join_policies.get(group_id)
+        if policy is None:
+            policy = self._build_policy(group_id)
+        return policy
+
+    def skip_reason(self, group_id):
+        """
+        返回群不进行进群检测的原因，用于日志
+        """
+        if not self.auto_check_groups:
+            return "未配置进群自动检测云黑功能的群白名单"
+        if self.enabled_groups and group_id not in self.enabled_groups:
+            return f"群 {group_id} 不在启用云黑检测的群列表中"
+        if group_id not in self.auto_check_groups:
+            return f"群 {group_id} 不在进群自动检测云黑功能的群白名单中"
+        return f"群 {group_id} 的独立配置关闭了进群检测"
+
+    def __len__(self):
+        return len(self._join_policies)
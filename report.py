@@ -0,0 +1,49 @@
+import astrbot.api.message_components as message_components
+
+# 单条合并转发消息最多包含的节点数，超过后拆分为多条
+MAX_FORWARD_NODES = 50
+
+
+def format_member(index, member):
+    """
+    格式化单个云黑成员
+    """
+    return "\n".join((
+        f"{index}. 用户ID: {member.id}",
+        f"   原因: {member.reason}",
+        f"   类型: {member.type}",
+        f"   管理员: {member.admin}",
+        f"   等级: {member.level}",
+        f"   日期: {member.date}",
+    ))
+
+
+def render_pages(members, page_size=10, start=0):
+    """
+    将云黑成员分页渲染为文本，start为第一个成员在全部结果中的位置（从0开始）
+    返回每页的文本列表
+    """
+    page_size = max(1, page_size)
+    pages = []
+    for offset in range(0, len(members), page_size):
+        chunk = members[offset:offset + page_size]
+        first = start + offset + 1
+        last = first + len(chunk) - 1
+        header = f"云黑成员（第 {first}-{last} 名）" if last > first else f"云黑成员（第 {first} 名）"
+        body = "\n\n".join(format_member(first + i, member) for i, member in enumerate(chunk))
+        pages.append(f"{header}\n\n{body}")
+    return pages
+
+
+def build_forward_messages(pages, uin, name="云黑检测"):
+    """
+    将分页文本转换为合并转发消息，每页一个节点，返回消息链列表
+    """
+    chains = []
+    for offset in range(0, len(pages), MAX_FORWARD_NODES):
+        nodes = [
+            message_components.Node(uin=str(uin), name=name, content=[message_components.Plain(page)])
+            for page in pages[offset:offset + MAX_FORWARD_NODES]
+        ]
+        chains.append([message_components.Nodes(nodes=nodes)])
+    return chains
@@ -0,0 +1,210 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+from astrbot.api import logger
+
+# 优先级，数值越小越优先
+PRIORITY_JOIN = 0  # 进群实时检测
+PRIORITY_SCAN = 1  # 大扫除等批量扫描
+
+# 共享频率窗口连续出错多少次后暂时只按本进程限制
+SHARED_MAX_FAILURES = 5
+# 共享频率窗口出错后的重试间隔（秒）
+SHARED_RETRY_DELAY = 0.1
+
+PRIORITY_NAMES = {
+    PRIORITY_JOIN: "进群检测",
+    PRIORITY_SCAN: "批量扫描",
+}
+
+
+class RateScheduler:
+    """
+    带优先级的异步令牌桶调度器
+    桶容量为max_requests，每个令牌在被使用time_window秒后才会回到桶中，
+    因此任意time_window秒内发出的请求数都不会超过max_requests。
+    所有令牌由唯一的调度协程发放，同一时刻醒来的请求不会一起越过限制；
+    高优先级的请求总是先拿到令牌，同一优先级内按群轮流发放，避免某个群独占额度。
+    请求从发放令牌到真正到达服务器之间有抖动，safety_margin为令牌回收额外等待的时间，
+    避免服务器统计时出现窗口内超过上限的情况。
+    设置shared_window时，每个令牌还需要从多个进程共享的频率窗口中获取
+    """
+
+    def __init__(self, max_requests=20, time_window=5, safety_margin=0.0, shared_window=None):
+        self.max_requests = max_requests
+        self.time_window = time_window
+        self.safety_margin = safety_margin
+        self.shared_window = shared_window
+        # 已发放令牌的时间（单调时钟）
+        self._grants = deque()
+        # {priority: OrderedDict{group_key: deque[(future, enqueued_at)]}}
+        self._queues = {}
+        self._wakeup = None
+        self._dispatcher = None
+        # 等待时间统计 {priority: {...}}
+        self._stats = {}
+        # 共享频率窗口连续出错的次数
+        self._shared_failures = 0
+
+    def _ensure_dispatcher(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    async def acquire(self, priority=PRIORITY_SCAN, group_id=None):
+        """
+        等待获取一个请求令牌，返回等待的秒数
+        """
+        self._ensure_dispatcher()
+        future = asyncio.get_running_loop().create_future()
+        enqueued_at = time.monotonic()
+        groups = self._queues.setdefault(priority, OrderedDict())
+        groups.setdefault(group_id, deque()).append((future, enqueued_at))
+        self._wakeup.set()
+        await future
+        waited = time.monotonic() - enqueued_at
+        self._record_wait(priority, waited)
+        return waited
+
+    def _record_wait(self, priority, waited):
+        stats = self._stats.get(priority)
+        if stats is None:
+            stats = self._stats[priority] = {"granted": 0, "total_wait": 0.0, "max_wait": 0.0, "recent": deque(maxlen=200)}
+        stats["granted"] += 1
+        stats["total_wait"] += waited
+        stats["max_wait"] = max(stats["max_wait"], waited)
+        stats["recent"].append(waited)
+
+    def _next_waiter(self, pop):
+        """
+        按优先级查找下一个等待者，同一优先级内按群轮流
+        pop为True时将其移出队列，并把该群移到队尾
+        """
+        for priority in sorted(self._queues):
+            groups = self._queues[priority]
+            while groups:
+                group_key, waiters = next(iter(groups.items()))
+                # 丢弃已被取消的等待者
+                while waiters and waiters[0][0].done():
+                    waiters.popleft()
+                if not waiters:
+                    del groups[group_key]
+                    continue
+                if not pop:
+                    return waiters[0]
+                waiter = waiters.popleft()
+                if waiters:
+                    groups.move_to_end(group_key)
+                else:
+                    del groups[group_key]
+                return waiter
+        return None
+
+    async def _dispatch(self):
+        while True:
+            if self._next_waiter(pop=False) is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            window = self.time_window + self.safety_margin
+            # 回收时间窗口外的令牌
+            while self._grants and self._grants[0] <= now - window:
+                self._grants.popleft()
+
+            if len(self._grants) >= self.max_requests:
+                sleep_time = self._grants[0] + window - now
+                logger.debug(f"达到频率限制，等待 {sleep_time:.2f} 秒")
+                await asyncio.sleep(sleep_time)
+                continue
+
+            if self.shared_window is not None:
+                sleep_time = await self._acquire_shared()
+                if sleep_time > 0:
+                    logger.debug(f"达到多进程共享的频率限制，等待 {sleep_time:.2f} 秒")
+                    await asyncio.sleep(sleep_time)
+                    continue
+                now = time.monotonic()
+
+            waiter = self._next_waiter(pop=True)
+            if waiter is None:
+                # 等待共享令牌期间请求全部被取消
+                continue
+            self._grants.append(now)
+            waiter[0].set_result(None)
+
+    async def _acquire_shared(self):
+        """
+        从共享频率窗口获取令牌，返回需要等待的秒数
+        其他进程持有锁时由try_acquire返回等待时间；偶发的错误稍后重试，
+        连续出错SHARED_MAX_FAILURES次后才认为共享存储不可用，暂时只按本进程的窗口限制
+        """
+        try:
+            sleep_time = await asyncio.get_running_loop().run_in_executor(None, self.shared_window.try_acquire)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._shared_failures += 1
+            if self._shared_failures < SHARED_MAX_FAILURES:
+                logger.warning(f"获取共享频率窗口令牌失败，稍后重试（第 {self._shared_failures} 次）: {str(e)}")
+                return SHARED_RETRY_DELAY
+            if self._shared_failures == SHARED_MAX_FAILURES:
+                logger.error(f"获取共享频率窗口令牌连续失败，暂时只按本进程限制: {str(e)}")
+            return 0.0
+        self._shared_failures = 0
+        return sleep_time
+
+    def queue_depth(self):
+        """
+        各优先级当前排队的请求数
+        """
+        return {
+            priority: sum(len(waiters) for waiters in groups.values())
+            for priority, groups in self._queues.items()
+        }
+
+    def snapshot(self):
+        """
+        返回调度器当前状态：窗口内已用令牌、各优先级排队数和等待时间
+        """
+        now = time.monotonic()
+        in_window = sum(1 for t in self._grants if t > now - self.time_window)
+        depth = self.queue_depth()
+        priorities = {}
+        for priority in sorted(set(depth) | set(self._stats)):
+            stats = self._stats.get(priority, {})
+            recent = stats.get("recent") or ()
+            granted = stats.get("granted", 0)
+            priorities[priority] = {
+                "name": PRIORITY_NAMES.get(priority, str(priority)),
+                "queued": depth.get(priority, 0),
+                "granted": granted,
+                "avg_wait": stats.get("total_wait", 0.0) / granted if granted else 0.0,
+                "recent_avg_wait": sum(recent) / len(recent) if recent else 0.0,
+                "max_wait": stats.get("max_wait", 0.0),
+            }
+        return {
+            "in_window": in_window,
+            "shared_in_window": self.shared_window.in_window() if self.shared_window is not None else None,
+            "max_requests": self.max_requests,
+            "time_window": self.time_window,
+            "priorities": priorities,
+        }
+
+    async def close(self):
+        if self._dispatcher and not self._dispatcher.done():
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+        # 唤醒仍在等待的请求
+        for groups in self._queues.values():
+            for waiters in groups.values():
+                for future, _ in waiters:
+                    if not future.done():
+                        future.cancel()
+        self._queues.clear()
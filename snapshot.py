@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class MemberSnapshotStore:
+    """
+    群成员快照
+    记录每个群的成员、进群（首次出现）时间和最近一次成功检查云黑状态的时间，用于增量扫描。
+    大群的同步和标记会写入上千行，应在线程池中调用
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        # 连接在线程池的多个线程间共用，同一时间只允许一个线程操作
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS group_members ("
+            "group_id TEXT NOT NULL, "
+            "user_id TEXT NOT NULL, "
+            "first_seen REAL NOT NULL, "
+            "last_verified REAL, "
+            "PRIMARY KEY (group_id, user_id))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS group_scans ("
+            "group_id TEXT PRIMARY KEY, "
+            "last_scan REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def sync_members(self, group_id, user_ids):
+        """
+        用当前成员列表更新快照：新成员记录首次出现时间，已退群的成员从快照中删除
+        返回新出现的成员数
+        """
+        group_id = str(group_id)
+        current = set(str(user_id) for user_id in user_ids)
+        with self._lock:
+            known = set(row[0] for row in self._conn.execute(
+                "SELECT user_id FROM group_members WHERE group_id = ?", (group_id,)
+            ))
+            now = time.time()
+            joined = current - known
+            left = known - current
+            self._conn.executemany(
+                "INSERT INTO group_members (group_id, user_id, first_seen, last_verified) VALUES (?, ?, ?, NULL)",
+                [(group_id, user_id, now) for user_id in joined]
+            )
+            self._conn.executemany(
+                "DELETE FROM group_members WHERE group_id = ? AND user_id = ?",
+                [(group_id, user_id) for user_id in left]
+            )
+            self._conn.commit()
+        return len(joined)
+
+    def select_stale(self, group_id, user_ids, max_age):
+        """
+        从成员列表中挑出需要重新检查的成员：快照中没有的新成员，或最近一次检查早于max_age秒之前的成员
+        """
+        group_id = str(group_id)
+        with self._lock:
+            verified = dict(self._conn.execute(
+                "SELECT user_id, last_verified FROM group_members WHERE group_id = ?", (group_id,)
+            ))
+        threshold = time.time() - max_age
+        stale = []
+        for user_id in user_ids:
+            last_verified = verified.get(str(user_id))
+            if last_verified is None or last_verified < threshold:
+                stale.append(user_id)
+        return stale
+
+    def mark_verified(self, group_id, user_ids):
+        """
+        记录成员已完成检查
+        """
+        now = time.time()
+        group_id = str(group_id)
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE group_members SET last_verified = ? WHERE group_id = ? AND user_id = ?",
+                [(now, group_id, str(user_id)) for user_id in user_ids]
+            )
+            self._conn.commit()
+
+    def set_last_scan(self, group_id):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO group_scans (group_id, last_scan) VALUES (?, ?)",
+                (str(group_id), time.time())
+            )
+            self._conn.commit()
+
+    def last_scan(self, group_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_scan FROM group_scans WHERE group_id = ?", (str(group_id),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        try:
+            with self._lock:
+                self._conn.close()
+        except Exception:
+            pass
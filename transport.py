@@ -0,0 +1,204 @@
+import asyncio
+import email.utils
+import random
+import time
+
+import httpx
+
+from astrbot.api import logger
+
+
+def full_jitter_backoff(attempt, base, cap):
+    """
+    全抖动退避：在 [0, min(cap, base * 2^attempt)] 之间随机等待，避免大量重试同时发出
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitOpenError(Exception):
+    """
+    熔断器处于打开状态，请求被直接拒绝
+    """
+
+
+class CircuitBreaker:
+    """
+    熔断器
+    连续失败达到阈值后打开，打开期间请求直接失败；经过recovery_timeout秒后进入半开状态，
+    只放行一个探测请求，探测成功则关闭，失败则重新打开
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow_request(self):
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.recovery_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+            logger.info("云黑API熔断器进入半开状态，发送探测请求")
+        # 半开状态下同一时间只允许一个探测请求
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("云黑API探测成功，熔断器关闭")
+        self.state = self.CLOSED
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"云黑API连续失败 {self._failures} 次，熔断器打开，{self.recovery_timeout} 秒内请求将直接失败")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def release_probe(self):
+        """
+        探测请求未真正发出（如排队时被取消）时释放探测名额
+        """
+        self._probe_in_flight = False
+
+    def remaining_open_time(self):
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+
+
+# 服务器要求的重试等待时间上限（秒）
+MAX_RETRY_AFTER = 60
+
+
+def _is_retryable_status(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+def _retry_after(response):
+    """
+    解析429响应的Retry-After头（秒数或HTTP日期），无法解析时返回None
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError, OverflowError):
+            return None
+    return min(MAX_RETRY_AFTER, max(0.0, seconds))
+
+
+class ResilientHttpClient:
+    """
+    带连接池、超时、重试和熔断的HTTP客户端
+    只用于幂等的GET请求，失败时按带抖动的指数退避重试。
+    只有网络错误和5xx计入熔断；429是服务器限流而不是故障，只重试不计入熔断
+    """
+
+    def __init__(self, max_connections=20, max_keepalive_connections=20, keepalive_expiry=30,
+                 connect_timeout=3, read_timeout=8, max_retries=2, backoff_base=0.5, backoff_max=5,
+                 failure_threshold=5, recovery_timeout=30, transport=None, metrics=None):
+        self.max_retries = max_retries
+        self.metrics = metrics
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(failure_threshold, recovery_timeout)
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            transport=transport
+        )
+
+    async def get(self, url, before_attempt=None):
+        """
+        发起GET请求，返回成功的响应
+        before_attempt为每次尝试前调用的协程函数（如获取频率限制令牌），重试同样需要经过它
+        熔断器打开时抛出CircuitOpenError，重试用尽后抛出最后一次的错误
+        """
+        attempt = 0
+        error = None
+        while True:
+            if not self.breaker.allow_request():
+                if self.metrics:
+                    self.metrics.inc("circuit_rejected_total")
+                # 重试过程中熔断器打开时，抛出真正导致失败的错误
+                if error is not None:
+                    raise error
+                raise CircuitOpenError(f"云黑API熔断中，{self.breaker.remaining_open_time():.0f} 秒后重试")
+            try:
+                if before_attempt is not None:
+                    await before_attempt()
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+
+            error = None
+            start = time.perf_counter()
+            try:
+                if self.metrics:
+                    self.metrics.inc("api_requests_total")
+                response = await self._client.get(url)
+            except httpx.TransportError as e:
+                self.breaker.record_failure()
+                error = e
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+            finally:
+                if self.metrics:
+                    self.metrics.observe("api_request_seconds", time.perf_counter() - start)
+            retry_after = None
+            if error is None:
+                if not _is_retryable_status(response.status_code):
+                    self.breaker.record_success()
+                    response.raise_for_status()
+                    return response
+                if response.status_code == 429:
+                    # 服务器正常响应，只是要求放慢速度；半开状态下让出探测名额
+                    self.breaker.release_probe()
+                    retry_after = _retry_after(response)
+                    if self.metrics:
+                        self.metrics.inc("api_throttled_total")
+                else:
+                    self.breaker.record_failure()
+                error = httpx.HTTPStatusError(
+                    f"服务器返回 {response.status_code}", request=response.request, response=response
+                )
+
+            if attempt >= self.max_retries:
+                raise error
+            delay = full_jitter_backoff(attempt, self.backoff_base, self.backoff_max)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            attempt += 1
+            if self.metrics:
+                self.metrics.inc("api_retries_total")
+            logger.debug(f"请求失败，{delay:.2f} 秒后重试（第 {attempt} 次）: {str(error)}")
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self._client.aclose()